@@ -1,81 +1,83 @@
 import random
+import re
 import config
 import discord
 from discord.ui import Button, View
-from supabase_client import clear_all_queues, clear_all_replays, delete_match, get_head_to_head_record, get_head_to_head_record_against_all, get_match_details, get_leaderboard, get_user, clear_rank, get_user_leaderboard_position, get_wins_and_losses, set_rank, update_replay_code
-from openai_client import gpt_response, store_message
+from supabase_client import clear_all_queues, clear_all_replays, delete_match, get_head_to_head_record, get_head_to_head_record_against_all, get_match_details, get_leaderboard, get_user, get_match_count, get_match_history, clear_rank, get_user_leaderboard_position, get_wins_and_losses, rebuild_wins_and_losses, refresh_organizers, set_rank, update_replay_code
+from openai_client import gpt_response, pooled_response, store_message
+from member_cache import member_index, get_user_profile, get_user_profiles, mention
 from datetime import datetime, timedelta
 
-from ui_components import Paginator
+from ui_components import Paginator, StreamedMessage
+from matchmaking import queues, queue_actors
 
 
+# Keywords that trigger a persona response, mapped to their response types
+KEYWORD_RESPONSE_TYPES = {
+    'genji': 'genji',
+    'mercy': 'mercy',
+    'ridge': 'ridge',
+    'gpttest': 'chat',
+}
+
+# Single case-insensitive pass over the message for any keyword, matched on word boundaries
+KEYWORD_PATTERN = re.compile(r"\b(" + "|".join(re.escape(keyword) for keyword in KEYWORD_RESPONSE_TYPES) + r")\b", re.IGNORECASE)
+
 # Main function to handle incoming messages
 async def handle_message(bot, message):
     msg = message.content
 
-    # Define a dictionary to map commands to their respective handler functions
-    commands = {
-        "!win": log_win_command,
-        "!loss": log_loss_command,
-        "!leaderboard": leaderboard_command,
-        "!match": match_command,
-        "!history": history_command,
-        "!replay": replay_command,
-        "!rank": rank_command,
-        "!h2h": h2h_command,
-        "!clearchat": clearchat_command,
-        "!clearrank": clearrank_command,
-        "!setrank": setrank_command,
-        "!clearqueue": clearqueue_command,
-        "!clearreplay": clear_replay_command,
-        "!deletematch": delete_match_command,
-        "!vantas": gpt_command,
-        "!help": help_command,
-        "!test": test_command,
-        "!sigma": sigma_command
-    }
-
-    # Split the message to get the command and arguments
-    command = msg.split()[0]
-
-    # Check if the command exists in the dictionary
-    if command in commands:
-        # Call the appropriate function from the dictionary
-        await commands[command](bot, message)
-        return
-
-    # Define a dictionary to map keywords to their respective response types
-    keyword_response_types = {
-        'genji': 'genji',
-        'mercy': 'mercy',
-        'ridge': 'ridge',
-        'gpttest': 'chat',
-    }
+    # Look the command up in the command table; attachment-only messages have no content to split
+    if msg.startswith(config.COMMAND_PREFIX):
+        command = msg.split(maxsplit=1)[0]
+        handler = COMMANDS.get(command)
+        if handler:
+            await handler(bot, message)
+            return
 
     # Check for keywords in the message and respond accordingly
-    for keyword, response_type in keyword_response_types.items():
-        if keyword in msg.lower():
-            response = gpt_response(msg, message.author.global_name, response_type)
+    keyword_match = KEYWORD_PATTERN.search(msg)
+    if keyword_match:
+        response_type = KEYWORD_RESPONSE_TYPES[keyword_match.group(1).lower()]
+
+        # Serve a pre-generated reply when one is ready; a user named Ridge still gets a personal reply
+        user_name = message.author.global_name
+        is_ridge = response_type == "ridge" and "ridge" in (user_name or "").lower()
+        response = None if is_ridge else pooled_response(msg, user_name, response_type, message.channel.id)
+        if response:
             await message.channel.send(response)
-            return
+        else:
+            await send_gpt_response(message, msg, response_type)
+        return
 
-    # If the message is a reply to another message
+    # If the message is a reply to another message, use the copy Discord sent with it or the message cache
     if message.reference:
-        # Retrieve the original message
-        original_message = await message.channel.fetch_message(message.reference.message_id)
+        original_message = message.reference.resolved or message.reference.cached_message
         # Check if the original message was sent by the bot
-        if original_message.author == bot.user:
-            response = gpt_response(msg, message.author.global_name, "reply", original_message.content)
-            await message.channel.send(response)
+        if isinstance(original_message, discord.Message) and original_message.author == bot.user:
+            await send_gpt_response(message, msg, "reply", original_message.content)
             return
 
     # If the message is neither a command nor a keyword, give it a one in fifty chance to call gpt_response
     if random.randint(1, 50) == 1:
-        response = gpt_response(msg, message.author.global_name, "chat")
-        await message.channel.send(response)
+        await send_gpt_response(message, msg, "chat")
     
     # Store the message in the conversation history
-    store_message(msg, message.author.global_name)
+    store_message(msg, message.author.global_name, message.channel.id)
+
+# Function to generate a response to a message and post it, streaming it into the channel when enabled
+# Returns the response, or None if the request was shed
+async def send_gpt_response(message, prompt, response_type="general", original_message=None):
+    if not config.STREAM_RESPONSES:
+        response = await gpt_response(prompt, message.author.global_name, response_type, original_message, message.channel.id)
+        if response:
+            await message.channel.send(response)
+        return response
+
+    streamed_message = StreamedMessage(message.channel)
+    response = await gpt_response(prompt, message.author.global_name, response_type, original_message, message.channel.id, on_update=streamed_message.update)
+    await streamed_message.finish(response)
+    return response
 
 # Function to test the bot
 async def test_command(bot, message):
@@ -102,7 +104,7 @@ async def leaderboard_command(bot, message):
         if len(parts) > 2 and parts[2].isdigit():
             page = int(parts[2])
 
-        leaderboard_data = get_leaderboard(game_name)
+        leaderboard_data = await get_leaderboard(game_name)
         if not leaderboard_data:
             await message.channel.send(f"{game_name_display} is not a supported game. Supported games: Overwatch, League")
             return
@@ -145,10 +147,9 @@ async def update_leaderboard_embed(embed, leaderboard_data, bot, game_name, page
     start_index = (page - 1) * page_size
     
     for index, (user_id, rank) in enumerate(leaderboard_data, start=start_index + 1):
-        user_mention = (await bot.fetch_user(int(user_id))).mention
         embed.add_field(
             name="",
-            value=f"{index}. {user_mention}: {rank}",
+            value=f"{index}. {mention(user_id)}: {rank}",
             inline=False
         )
 
@@ -169,9 +170,9 @@ async def rank_command(bot, message):
         await message.channel.send("User not found or invalid identifier.")
         return
 
-    rank_data = get_user(target_user_id)
-    wins_losses_data = get_wins_and_losses(target_user_id)
-    user = await bot.fetch_user(target_user_id)
+    rank_data = await get_user(target_user_id)
+    wins_losses_data = await get_wins_and_losses(target_user_id)
+    user = await get_user_profile(bot, target_user_id)
     display_name = user.global_name
     avatar_url = user.avatar.url
     
@@ -184,11 +185,11 @@ async def rank_command(bot, message):
         # Add the avatar
         rank_embed.set_author(name=display_name + "'s Profile", icon_url=avatar_url)
 
-        for game, rank in rank_data.items():
-            if game != "matches" and game != "user_id":
-                position, mmr = get_user_leaderboard_position(game.lower(), target_user_id)
+        for game in config.GAMES:
+            if game in rank_data:
+                position, mmr = await get_user_leaderboard_position(game, target_user_id)
                 if position is not None and mmr is not None:
-                    wins_losses = wins_losses_data.get(game.lower(), {'wins': 0, 'losses': 0}) # type: ignore
+                    wins_losses = wins_losses_data.get(game.lower(), {'wins': 0, 'losses': 0})
                     rank_embed.add_field(
                         name=f"{game.capitalize()}",
                         value=f"Rank: {position}\nMMR: {mmr}\nWL: {wins_losses['wins']}-{wins_losses['losses']}",
@@ -216,7 +217,7 @@ async def clearrank_command(bot, message):
             target_user_id = await resolve_user(bot, user_identifier)
             
             if target_user_id:
-                clear_rank(target_user_id)
+                await clear_rank(target_user_id)
                 await message.channel.send(f"Rank cleared for user {target_user_id}.")
             else:
                 await message.channel.send("User not found or invalid identifier.")
@@ -239,9 +240,9 @@ async def setrank_command(bot, message):
             target_user_id = await resolve_user(bot, user_identifier)
             
             if target_user_id:
-                display_name = (await bot.fetch_user(target_user_id)).global_name
+                display_name = (await get_user_profile(bot, target_user_id)).global_name
                 if game_name in config.GAMES:
-                    set_rank(target_user_id, game_name, rank)
+                    await set_rank(target_user_id, game_name, rank)
                     await message.channel.send(f"Rank set to {rank} for user {display_name} in game {game_name.capitalize()}.")
                 else:
                     await message.channel.send(f"Invalid game name. Available games: {', '.join(g.capitalize() for g in config.GAMES)}")
@@ -275,66 +276,59 @@ async def history_command(bot, message):
         await message.channel.send("User not found or invalid identifier.")
         return
 
-    rank_data = get_user(target_user_id)
-    display_name = (await bot.fetch_user(int(target_user_id))).global_name
-    if not rank_data or not rank_data.get("matches"):
+    total_matches = await get_match_count(target_user_id)
+    display_name = (await get_user_profile(bot, target_user_id)).global_name
+    if not total_matches:
         await message.channel.send(f"No match history found for user {display_name}.")
         return
 
-    matches_with_time = []
-    for match_id in rank_data["matches"]:
-        match_details = get_match_details(match_id)
-        if match_details:
-            match_time = datetime.fromisoformat(match_details["created_at"].replace('Z', '+00:00'))
-            matches_with_time.append((match_id, match_time))
-
-    matches_with_time.sort(key=lambda x: x[1], reverse=True)
-    sorted_match_ids = [match_id for match_id, _ in matches_with_time]
-
     matches_per_page = 10
-    total_matches = len(sorted_match_ids)
     total_pages = (total_matches + matches_per_page - 1) // matches_per_page
 
+    # Keyset cursors: the (created_at, match_id) of the last match shown before each page
+    cursors = {1: None}
+
+    # Function to fetch a page of history on demand, using the keyset cursor when the page before it has been seen
+    async def fetch_history_page(page, page_size):
+        after = cursors.get(page)
+        if after or page == 1:
+            matches = await get_match_history(target_user_id, page_size, after=after)
+        else:
+            matches = await get_match_history(target_user_id, page_size, offset=(page - 1) * page_size)
+        if matches:
+            cursors[page + 1] = (matches[-1]["created_at"], matches[-1]["match_id"])
+        return matches
+
     # Create an embed directly
     embed = discord.Embed(
         title=f"{display_name}'s Match History",
         color=discord.Color.blue()
     )
 
-    start_index = (page - 1) * matches_per_page
-    end_index = start_index + matches_per_page
-    match_ids_page = sorted_match_ids[start_index:end_index]
+    matches_page = await fetch_history_page(page, matches_per_page)
 
-    await update_history_embed(embed, match_ids_page, target_user_id)
+    await update_history_embed(embed, matches_page, bot, page, matches_per_page)
 
     embed.set_footer(text=f"Page {page} of {total_pages}")
 
     paginator = Paginator(
         bot=bot,
         title=f"{display_name}'s Match History",
-        data=sorted_match_ids,
+        data=None,
         page_size=matches_per_page,
         page=page,
         total_pages=total_pages,
         update_func=update_history_embed,
-        target_user_id=target_user_id
+        fetch_page=fetch_history_page
     )
     
     # Send the message with the initial embed and the paginator buttons
     await message.channel.send(embed=embed, view=paginator)
 
-async def update_history_embed(embed, match_ids, target_user_id):
-    for match_id in match_ids:
-        match_details = get_match_details(match_id)
-        if not match_details:
-            continue
-
-        if target_user_id in match_details["team1"]:
-            status = "Win" if match_details["winner"] == "Team A" else "Loss"
-        elif target_user_id in match_details["team2"]:
-            status = "Win" if match_details["winner"] == "Team B" else "Loss"
-        else:
-            status = "Unknown"
+async def update_history_embed(embed, matches, bot, page, page_size):
+    for match_details in matches:
+        match_id = match_details["match_id"]
+        status = "Win" if match_details["winner"] == match_details["team"] else "Loss"
 
         match_time = datetime.fromisoformat(match_details["created_at"].replace('Z', '+00:00'))
         match_time_adjusted = match_time - timedelta(hours=4)
@@ -365,7 +359,7 @@ async def match_command(bot, message):
 
     try:
         # Attempt to get match details
-        match_details = get_match_details(match_id)
+        match_details = await get_match_details(match_id)
         if not match_details:
             await message.channel.send("No match found with the provided ID.")
             return
@@ -380,11 +374,9 @@ async def match_command(bot, message):
         # Remove leading zero from day
         formatted_time = formatted_time.replace(" 0", " ")
 
-        # Fetch the global names of the players on both teams
-        team1_mentions = [await bot.fetch_user(int(user_id)) for user_id in match_details["team1"]]
-        team2_mentions = [await bot.fetch_user(int(user_id)) for user_id in match_details["team2"]]
-        team1_mentions = "\n".join([user.mention for user in team1_mentions])
-        team2_mentions = "\n".join([user.mention for user in team2_mentions])
+        # Render the players on both teams as mentions straight from their IDs
+        team1_mentions = "\n".join([mention(user_id) for user_id in match_details["team1"]])
+        team2_mentions = "\n".join([mention(user_id) for user_id in match_details["team2"]])
 
         # Add replay code if available
         replay_code = match_details.get("replay")
@@ -422,13 +414,13 @@ async def replay_command(bot, message):
     replay_code = parts[2]
 
     # Verify the match exists
-    match_details = get_match_details(match_id)
+    match_details = await get_match_details(match_id)
     if not match_details:
         await message.channel.send(f"No match found with ID {match_id}.")
         return
 
     # Update the replay column in the matches table
-    update_replay_code(match_id, replay_code)
+    await update_replay_code(match_id, replay_code)
 
     await message.channel.send(f"Replay code '{replay_code}' stored for match ID: {match_id}.")
 
@@ -443,7 +435,7 @@ async def clearqueue_command(bot, message):
 # Function to clear the replay code for all matches
 async def clear_replay_command(bot, message):
     if has_og_role(message.author):
-        clear_all_replays()
+        await clear_all_replays()
         await message.channel.send("Replay codes have been cleared for all matches.")
     else:
         await message.channel.send("You do not have permission to use this command.")
@@ -456,8 +448,10 @@ async def delete_match_command(bot, message):
         if len(parts) == 2:
             match_id = parts[1]
             try:
-                delete_match(match_id)
-                await message.channel.send(f"Match {match_id} and associated references have been deleted.")
+                if await delete_match(match_id):
+                    await message.channel.send(f"Match {match_id} and associated references have been deleted.")
+                else:
+                    await message.channel.send(f"No match found with ID {match_id}.")
             except Exception as e:
                 await message.channel.send(f"An error occurred while deleting match {match_id}: {e}")
         else:
@@ -465,11 +459,54 @@ async def delete_match_command(bot, message):
     else:
         await message.channel.send("You do not have permission to use this command.")
 
+# Function to rebuild the win/loss counters from match history (OG role only)
+async def rebuild_stats_command(bot, message):
+    if has_og_role(message.author):
+        await rebuild_wins_and_losses()
+        await message.channel.send("Win/loss records have been rebuilt from match history.")
+    else:
+        await message.channel.send("You do not have permission to use this command.")
+
+# Function to reload the organizer list after it has been changed (OG role only)
+async def refresh_organizers_command(bot, message):
+    if has_og_role(message.author):
+        organizers = await refresh_organizers()
+        await message.channel.send(f"Organizer list reloaded. {len(organizers)} organizers found.")
+    else:
+        await message.channel.send("You do not have permission to use this command.")
+
+# Function to show queue throughput and contention counters for each channel (OG role only)
+async def queuestats_command(bot, message):
+    if not has_og_role(message.author):
+        await message.channel.send("You do not have permission to use this command.")
+        return
+
+    lines = ["**Queue Stats**"]
+    for channel_id, actor in queue_actors.items():
+        stats = actor.stats
+        average_wait = stats["wait_total"] / stats["processed"] if stats["processed"] else 0.0
+        lines.append(
+            f"{queues[channel_id]['title']}: {stats['processed']} ops, "
+            f"{actor.recent_throughput():.2f} ops/s over the last {config.QUEUE_STATS_WINDOW}s, peak {stats['peak_ops_per_second']} ops/s, "
+            f"wait {average_wait * 1000:.1f} ms avg / {stats['wait_max'] * 1000:.1f} ms max, "
+            f"{stats['joins']} joins, {stats['leaves']} leaves, {stats['rejected']} rejected, "
+            f"{stats['pops']} pops, peak backlog {stats['peak_backlog']}"
+        )
+    if len(lines) == 1:
+        lines.append("No queue activity yet.")
+    await message.channel.send("\n".join(lines))
+
 # Function to handle the get head-to-head record
 async def h2h_command(bot, message):
     msg = message.content
     parts = msg.split()
 
+    # An optional trailing game name limits the record to that game
+    game_name = None
+    if len(parts) > 1 and parts[-1].lower() in config.GAMES:
+        game_name = parts.pop().lower()
+    game_suffix = f" ({game_name.capitalize()})" if game_name else ""
+
     if len(parts) == 1:  # Just !h2h, show user's H2H against everyone
         user_identifier = str(message.author.id)
 
@@ -478,7 +515,7 @@ async def h2h_command(bot, message):
             await message.channel.send("User not found or invalid identifier.")
             return
 
-        records = get_head_to_head_record_against_all(user_id)
+        records = await get_head_to_head_record_against_all(user_id, game_name)
         if not records:
             await message.channel.send("No matches found against any players.")
             return
@@ -486,10 +523,11 @@ async def h2h_command(bot, message):
         records_per_page = 15
         total_records = len(records)
         total_pages = (total_records + records_per_page - 1) // records_per_page
+        title = f"{(await get_user_profile(bot, user_id)).global_name}'s Head-to-Head Record{game_suffix}"
 
         # Create an embed directly
         embed = discord.Embed(
-            title=f"{(await bot.fetch_user(user_id)).global_name}'s Head-to-Head Record",
+            title=title,
             color=discord.Color.purple()
         )
 
@@ -497,13 +535,13 @@ async def h2h_command(bot, message):
         end_index = start_index + records_per_page
         records_page = records[start_index:end_index]
 
-        await update_h2h_embed(embed, records_page, bot)
+        await update_h2h_embed(embed, records_page, bot, page=1, page_size=records_per_page)
 
         embed.set_footer(text=f"Page 1 of {total_pages}")
 
         paginator = Paginator(
             bot=bot,
-            title=f"{(await bot.fetch_user(user_id)).global_name}'s Head-to-Head Record",
+            title=title,
             data=records,
             page_size=records_per_page,
             page=1,
@@ -514,9 +552,13 @@ async def h2h_command(bot, message):
         # Send the message with the initial embed and the paginator buttons
         await message.channel.send(embed=embed, view=paginator)
 
-    elif len(parts) == 2:  # !h2h <user>
-        user_identifier1 = str(message.author.id)
-        user_identifier2 = parts[1]
+    elif len(parts) in (2, 3):  # !h2h <user> or !h2h <user1> <user2>
+        if len(parts) == 2:
+            user_identifier1 = str(message.author.id)
+            user_identifier2 = parts[1]
+        else:
+            user_identifier1 = parts[1]
+            user_identifier2 = parts[2]
 
         user1_id = await resolve_user(bot, user_identifier1)
         user2_id = await resolve_user(bot, user_identifier2)
@@ -525,68 +567,39 @@ async def h2h_command(bot, message):
             await message.channel.send("One or both users could not be found.")
             return
 
-        record = get_head_to_head_record(user1_id, user2_id)
+        record = await get_head_to_head_record(user1_id, user2_id, game_name)
         if not record:
             await message.channel.send("No matches found between these two users.")
             return
 
-        h2h_embed = discord.Embed(
-            title=f"Head-to-Head: {(await bot.fetch_user(user1_id)).global_name} vs {(await bot.fetch_user(user2_id)).global_name}",
-            color=discord.Color.purple()
-        )
-        h2h_embed.add_field(
-            name=f"{(await bot.fetch_user(user1_id)).global_name} Wins",
-            value=f"{record['user1_wins']}",
-            inline=True
-        )
-        h2h_embed.add_field(
-            name=f"{(await bot.fetch_user(user2_id)).global_name} Wins",
-            value=f"{record['user2_wins']}",
-            inline=True
-        )
-        await message.channel.send(embed=h2h_embed)
-
-    elif len(parts) == 3:  # !h2h <user1> <user2>
-        user_identifier1 = parts[1]
-        user_identifier2 = parts[2]
-
-        user1_id = await resolve_user(bot, user_identifier1)
-        user2_id = await resolve_user(bot, user_identifier2)
-
-        if not user1_id or not user2_id:
-            await message.channel.send("One or both users could not be found.")
-            return
-
-        record = get_head_to_head_record(user1_id, user2_id)
-        if not record:
-            await message.channel.send("No matches found between these two users.")
-            return
+        profiles = await get_user_profiles(bot, [user1_id, user2_id])
+        user1_name = profiles[int(user1_id)].global_name
+        user2_name = profiles[int(user2_id)].global_name
 
         h2h_embed = discord.Embed(
-            title=f"Head-to-Head: {(await bot.fetch_user(user1_id)).global_name} vs {(await bot.fetch_user(user2_id)).global_name}",
+            title=f"Head-to-Head: {user1_name} vs {user2_name}{game_suffix}",
             color=discord.Color.purple()
         )
         h2h_embed.add_field(
-            name=f"{(await bot.fetch_user(user1_id)).global_name} Wins",
+            name=f"{user1_name} Wins",
             value=f"{record['user1_wins']}",
             inline=True
         )
         h2h_embed.add_field(
-            name=f"{(await bot.fetch_user(user2_id)).global_name} Wins",
+            name=f"{user2_name} Wins",
             value=f"{record['user2_wins']}",
             inline=True
         )
         await message.channel.send(embed=h2h_embed)
 
     else:
-        await message.channel.send("Invalid usage. Usage: !h2h, !h2h <user>, or !h2h <user1> <user2>")
+        await message.channel.send("Invalid usage. Usage: !h2h, !h2h <user>, or !h2h <user1> <user2>, optionally followed by a game name")
 
-async def update_h2h_embed(embed, records, bot):
+async def update_h2h_embed(embed, records, bot, page, page_size):
     for opponent_id, record in records:
-        opponent_name = (await bot.fetch_user(int(opponent_id))).mention
         embed.add_field(
             name="",
-            value=f"{opponent_name}: {record['wins']}-{record['losses']}",
+            value=f"{mention(opponent_id)}: {record['wins']}-{record['losses']}",
             inline=False
         )
 
@@ -628,8 +641,9 @@ async def clearchat_command(bot, message):
 async def gpt_command(bot, message):
     msg = message.content
     prompt = msg[len("!vantas "):].strip()
-    response = gpt_response(prompt, message.author.global_name)
-    await message.channel.send(response)
+    response = await send_gpt_response(message, prompt)
+    if response is None:
+        await message.channel.send("Too many people are talking to me right now. Try again in a bit.")
 
 # Function to show the help message
 async def help_command(bot, message):
@@ -641,7 +655,7 @@ async def help_command(bot, message):
         "!replay <match_id> <replay_code> - Store a replay code for a match\n"
         "!leaderboard <game_name> <page>* - Show the leaderboard for a game\n"
         "!rank <user>* - Check individual rank for a player. Default is you\n"
-        "!h2h <user>* <user>* - Show head-to-head record for users. Default is you\n\n"
+        "!h2h <user>* <user>* <game_name>* - Show head-to-head record for users. Default is you\n\n"
         "**Admin Commands:**\n"
         "!setrank <user> <game_name> <rank> - Set rank for a player\n"
         "!clearchat <number> - Clear chat messages\n"
@@ -649,6 +663,9 @@ async def help_command(bot, message):
         "!clearqueue - Clear all active queues\n"
         "!clearreplay - Clear all replay codes\n"
         "!deletematch <match_id> - Delete a match by ID\n"
+        "!rebuildstats - Rebuild win/loss records from match history\n"
+        "!refreshorganizers - Reload the organizer list\n"
+        "!queuestats - Show queue throughput stats\n"
         "!help - Show this help message\n\n"
 
         "*\\*Optional*"
@@ -662,20 +679,45 @@ def has_og_role(member):
 
 # Function to resolve a user identifier to a user ID
 async def resolve_user(bot, user_identifier):
-    guild = bot.get_guild(config.GUILD_ID)
-    
-    # Fetch all members manually using an async generator
-    members = [member async for member in guild.fetch_members(limit=None)]
-
-    if user_identifier.isdigit():
-        # Check if it's a user ID
-        user = discord.utils.get(members, id=int(user_identifier))
-    else:
-        # Otherwise, try to find by name
-        user = discord.utils.find(lambda m: m.name == user_identifier or m.global_name == user_identifier, members)
+    # Look the identifier up in the member index instead of downloading the whole member list
+    user = member_index.resolve(user_identifier)
+
+    if user is None and user_identifier.isdigit():
+        # The member may not be cached yet, so fetch just this one member
+        guild = bot.get_guild(config.GUILD_ID)
+        try:
+            user = await guild.fetch_member(int(user_identifier))
+            member_index.add(user)
+        except discord.NotFound:
+            user = None
     
     return str(user.id) if user else None
 
 # pugx function
 async def sigma_command(bot, message):
-    await message.channel.send("erm what the sigma")
\ No newline at end of file
+    await message.channel.send("erm what the sigma")
+
+# Command table mapping each command to its handler function
+COMMANDS = {
+    "!win": log_win_command,
+    "!loss": log_loss_command,
+    "!leaderboard": leaderboard_command,
+    "!match": match_command,
+    "!history": history_command,
+    "!replay": replay_command,
+    "!rank": rank_command,
+    "!h2h": h2h_command,
+    "!clearchat": clearchat_command,
+    "!clearrank": clearrank_command,
+    "!setrank": setrank_command,
+    "!clearqueue": clearqueue_command,
+    "!clearreplay": clear_replay_command,
+    "!deletematch": delete_match_command,
+    "!rebuildstats": rebuild_stats_command,
+    "!refreshorganizers": refresh_organizers_command,
+    "!queuestats": queuestats_command,
+    "!vantas": gpt_command,
+    "!help": help_command,
+    "!test": test_command,
+    "!sigma": sigma_command
+}
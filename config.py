@@ -8,6 +8,43 @@ DISCORD_TOKEN = os.getenv('DISCORD_TOKEN')
 SUPABASE_URL = os.getenv("SUPABASE_URL")
 SUPABASE_KEY = os.getenv("SUPABASE_KEY")
 OPENAI_KEY = os.getenv("OPENAI_KEY")
+SUPABASE_MAX_WORKERS = 8
+ORGANIZER_CACHE_TTL = 300
+# Team balancing: penalty per point of difference in team rating spread, and per pair of recent teammates kept together
+BALANCE_SPREAD_WEIGHT = 0.1
+BALANCE_REPEAT_WEIGHT = 10
+RECENT_MATCHES_TRACKED = 3
+USER_CACHE_SIZE = 1000
+USER_CACHE_TTL = 3600
+# OpenAI request pool: concurrent completions, queue depth at which random chatter is shed,
+# queue depth at which every request is rejected, and the deadline in seconds for !vantas
+OPENAI_MAX_CONCURRENCY = 4
+OPENAI_SHED_QUEUE_DEPTH = 4
+OPENAI_MAX_QUEUE_DEPTH = 20
+OPENAI_COMMAND_DEADLINE = 15
+# Per-channel conversation memory: hard message cap, approximate token budget, and idle seconds before eviction
+CONVERSATION_MAX_MESSAGES = 50
+CONVERSATION_TOKEN_BUDGET = 2000
+CONVERSATION_IDLE_TIMEOUT = 3600
+# Stream LLM responses into a placeholder message, editing it at most once per STREAM_EDIT_INTERVAL seconds
+STREAM_RESPONSES = True
+STREAM_EDIT_INTERVAL = 1.0
+# Keyword response types served from pre-generated pools, replies kept per pool, and seconds before a reply expires
+POOLED_RESPONSE_TYPES = ["genji", "mercy", "ridge"]
+RESPONSE_POOL_SIZE = 5
+RESPONSE_POOL_TTL = 1800
+# Seconds over which queue embed changes are coalesced into one message edit
+QUEUE_EMBED_UPDATE_WINDOW = 1.0
+# Seconds over which queue state changes are coalesced into one database write, and the retry backoff bounds
+QUEUE_PERSIST_WINDOW = 0.5
+QUEUE_PERSIST_RETRY_DELAY = 1
+QUEUE_PERSIST_MAX_RETRY_DELAY = 60
+# Maximum number of voice moves in flight at once when moving a lobby
+VOICE_MOVE_CONCURRENCY = 12
+# Seconds after its last change that an abandoned match session is dropped
+MATCH_SESSION_TTL = 12 * 3600
+# Seconds of recent queue operations that !queuestats averages throughput over
+QUEUE_STATS_WINDOW = 60
 GAMES = ["overwatch", "league"]
 GUILD_ID = 1262417429305360395
 CHANNEL_INFO = [{
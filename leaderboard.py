@@ -0,0 +1,43 @@
+import bisect
+
+# In-memory leaderboard for a single game, kept sorted by rating (highest first)
+# Entries are stored as (-rating, user_id) so the natural tuple order is the leaderboard order
+class LeaderboardIndex:
+    def __init__(self, records=()):
+        self.ratings = {}
+        self.entries = []
+        for user_id, rating in records:
+            if rating is not None:
+                self.ratings[str(user_id)] = rating
+        self.entries = sorted((-rating, user_id) for user_id, rating in self.ratings.items())
+
+    def __len__(self):
+        return len(self.entries)
+
+    # Supports slicing so a page can be taken directly, e.g. index[10:20]
+    def __getitem__(self, key):
+        if isinstance(key, slice):
+            return [(user_id, -rating) for rating, user_id in self.entries[key]]
+        rating, user_id = self.entries[key]
+        return user_id, -rating
+
+    def __iter__(self):
+        return ((user_id, -rating) for rating, user_id in self.entries)
+
+    # Function to set (or remove, when rating is None) a user's rating in place
+    def set(self, user_id, rating):
+        user_id = str(user_id)
+        old_rating = self.ratings.pop(user_id, None)
+        if old_rating is not None:
+            del self.entries[bisect.bisect_left(self.entries, (-old_rating, user_id))]
+        if rating is not None:
+            self.ratings[user_id] = rating
+            bisect.insort(self.entries, (-rating, user_id))
+
+    # Function to get a user's 1-based position and rating, or (None, None) if unranked
+    def position(self, user_id):
+        user_id = str(user_id)
+        rating = self.ratings.get(user_id)
+        if rating is None:
+            return None, None
+        return bisect.bisect_left(self.entries, (-rating, user_id)) + 1, rating
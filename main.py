@@ -1,29 +1,73 @@
 import discord
 from discord.ext import commands
-from matchmaking import initialize_queues
+from matchmaking import initialize_queues, flush_queue_state, restore_match_sessions
 from commands import handle_message
+from member_cache import member_index, handle_user_update
+from openai_client import warm_response_pools
 import asyncio
-from supabase_client import increment_ping_if_due
+from supabase_client import increment_ping_if_due, load_leaderboards
 import config
 
 # Initialize the bot with necessary intents
 intents = discord.Intents.default()
 intents.message_content = True
 intents.members = True
-bot = commands.Bot(command_prefix=config.COMMAND_PREFIX, intents=intents)
+
+# Bot that writes any pending queue state to Supabase before disconnecting
+class VantasBot(commands.Bot):
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.initialized = False
+
+    async def close(self):
+        await flush_queue_state()
+        await super().close()
+
+bot = VantasBot(command_prefix=config.COMMAND_PREFIX, intents=intents)
 
 # Event handler for when the bot is ready
 @bot.event
 async def on_ready():
     print(f'Logged in as {bot.user}')
+    member_index.build(bot.get_guild(config.GUILD_ID).members)
+
+    # on_ready fires again after a reconnect; the queues and background tasks are only set up once
+    if bot.initialized:
+        return
+    bot.initialized = True
+
+    await load_leaderboards(config.GAMES)
+    warm_response_pools()
+    # Match sessions are restored first so starting the queues never deletes a live lobby
+    await restore_match_sessions(bot)
     await initialize_queues(bot, config.CHANNEL_INFO)
     bot.loop.create_task(schedule_ping_update())
 
 async def schedule_ping_update():
     while True:
-        increment_ping_if_due(bot)
+        await increment_ping_if_due(bot)
         await asyncio.sleep(86400) 
 
+# Event handlers that keep the member index in sync with the gateway member cache
+@bot.event
+async def on_member_join(member):
+    if member.guild.id == config.GUILD_ID:
+        member_index.add(member)
+
+@bot.event
+async def on_member_update(before, after):
+    if after.guild.id == config.GUILD_ID:
+        member_index.update(before, after)
+
+@bot.event
+async def on_member_remove(member):
+    if member.guild.id == config.GUILD_ID:
+        member_index.remove(member)
+
+@bot.event
+async def on_user_update(before, after):
+    handle_user_update(before, after)
+
 # Event handler for when a message is received
 @bot.event
 async def on_message(message):
@@ -0,0 +1,115 @@
+import secrets
+import time
+import config
+from supabase_client import save_match_session, delete_match_session
+
+# Compact record of an in-flight match lobby, from the team suggestion through to requeue
+# Only IDs and ratings are stored, so a session can be saved and its views rebuilt after a restart
+# Stages: "teams" (editing teams), "map" (picking a map), "playing" (waiting for the result), "result" (requeue or finish)
+class MatchSession:
+    __slots__ = (
+        "session_id",
+        "channel_id",
+        "game_name",
+        "organizer_id",
+        "team_a",
+        "team_b",
+        "stage",
+        "match_id",
+        "maps",
+        "map_page",
+        "message_id",
+        "winner_message_id",
+        "message_ids",
+        "last_active"
+    )
+
+    def __init__(self, session_id, channel_id, game_name, organizer_id, team_a, team_b, stage="teams",
+                 match_id=None, maps=None, map_page=1, message_id=None, winner_message_id=None, message_ids=None, last_active=None):
+        self.session_id = session_id
+        self.channel_id = channel_id
+        self.game_name = game_name
+        self.organizer_id = organizer_id
+        # Lists of (user_id, rating) tuples
+        self.team_a = [(int(user_id), rating) for user_id, rating in team_a]
+        self.team_b = [(int(user_id), rating) for user_id, rating in team_b]
+        self.stage = stage
+        self.match_id = match_id
+        self.maps = maps or []
+        self.map_page = map_page
+        # The message carrying the session's current view, and the winner prompt while it is open
+        self.message_id = message_id
+        self.winner_message_id = winner_message_id
+        # Every message the bot has posted for the match that still exists, so cleanup never touches another lobby
+        self.message_ids = message_ids or []
+        # Wall-clock time of the last change, used to drop abandoned lobbies
+        self.last_active = last_active or time.time()
+
+    def to_dict(self):
+        return {slot: getattr(self, slot) for slot in self.__slots__}
+
+    def track_message(self, message_id):
+        if message_id not in self.message_ids:
+            self.message_ids.append(message_id)
+
+    def untrack_message(self, message_id):
+        if message_id in self.message_ids:
+            self.message_ids.remove(message_id)
+
+    # Function to build the custom_id of one of the session's components, e.g. match:1a2b3c4d5e6f:confirm
+    def custom_id(self, action):
+        return f"match:{self.session_id}:{action}"
+
+    # A session has ended once it is no longer in sessions, e.g. after Requeue, Finish or expiry
+    @property
+    def ended(self):
+        return sessions.get(self.session_id) is not self
+
+    async def save(self):
+        # Never write an ended session back, or it would be restored again on the next boot
+        if self.ended:
+            return
+        self.last_active = time.time()
+        try:
+            await save_match_session(self.session_id, self.channel_id, self.to_dict())
+        except Exception as e:
+            print(f"Error saving match session {self.session_id}: {e}")
+
+    # Function to forget the session once its lobby is finished
+    async def end(self):
+        sessions.pop(self.session_id, None)
+        try:
+            await delete_match_session(self.session_id)
+        except Exception as e:
+            print(f"Error deleting match session {self.session_id}: {e}")
+
+# Dictionary to hold every in-flight match session by session ID
+sessions = {}
+
+# Function to end sessions that have not changed for MATCH_SESSION_TTL seconds
+# Their saved rows and messages are removed the next time sessions are restored
+def expire_sessions():
+    cutoff = time.time() - config.MATCH_SESSION_TTL
+    for session_id in [session_id for session_id, session in sessions.items() if session.last_active < cutoff]:
+        del sessions[session_id]
+
+# Function to start a session for a popped queue; team_a and team_b are lists of (user_id, rating)
+def create_session(channel_id, game_name, organizer_id, team_a, team_b):
+    expire_sessions()
+    session = MatchSession(secrets.token_hex(6), channel_id, game_name, organizer_id, team_a, team_b)
+    sessions[session.session_id] = session
+    return session
+
+# Function to rebuild a session from its saved state
+def load_session(state):
+    session = MatchSession(**state)
+    sessions[session.session_id] = session
+    return session
+
+# Function to get the IDs of every message belonging to an in-flight session in a channel
+def live_session_message_ids(channel_id):
+    return {
+        message_id
+        for session in sessions.values() if session.channel_id == channel_id
+        for message_id in session.message_ids
+    }
@@ -1,43 +1,387 @@
+import asyncio
+import time
 import discord
-from supabase_client import get_queue_data, update_queue_data, get_leaderboard, get_user, is_organizer
-from ui_components import QueueView, TeamManagementView, create_team_embed
+import config
+from collections import deque
+from itertools import combinations
+from supabase_client import get_queue_data, update_queue_data, get_leaderboard, get_roster, get_match_sessions, delete_stale_match_sessions
+from team_balancer import balance_teams
+from ui_components import QueueView, TeamManagementView, build_session_views, create_team_embed, delete_messages_by_id
+from member_cache import get_user_profiles, mention
+from match_session import create_session, load_session, live_session_message_ids
 import random
 
 # Dictionary to hold queue information for each channel
 queues = {}
 
-# Function to initialize queues for each channel
-async def initialize_queues(bot, channel_info):
-    for info in channel_info:
-        channel = bot.get_channel(info["channel_id"])
-        await delete_bot_messages(channel)  # Delete previous bot messages
-
-        # Load the queue state from Supabase if it exists
-        queue_state = get_queue_data(info["channel_id"])
-        if queue_state:
-            queue_members = [await bot.fetch_user(user_id) for user_id in queue_state["queue"] if await bot.fetch_user(user_id)]
-        else:
-            queue_state = []
-            queue_members = []
-
-        # Store the queue information in the queues dictionary
-        queues[info["channel_id"]] = {
-            "title": info["title"],
-            "queue": queue_members,
-            "max_players": info["max_players"],
-            "message_id": None,
-            "organizer_id": None
+# Dictionary to hold the most recently confirmed teams for each game
+recent_teams = {}
+
+# Function to remember a confirmed match's teams so the balancer can avoid repeating teammates
+def record_teams(game_name, team_a_ids, team_b_ids):
+    history = recent_teams.setdefault(game_name, deque(maxlen=2 * config.RECENT_MATCHES_TRACKED))
+    history.append(frozenset(team_a_ids))
+    history.append(frozenset(team_b_ids))
+
+# Coalesces queue embed updates for a channel into at most one edit per QUEUE_EMBED_UPDATE_WINDOW seconds
+# The queue Message is cached, and each edit renders the latest queue state
+class QueueMessageUpdater:
+    def __init__(self, channel, channel_id, message=None):
+        self.channel = channel
+        self.channel_id = channel_id
+        self.message = message
+        self.dirty = False
+        self.task = None
+
+    def request_update(self):
+        self.dirty = True
+        if self.task is None or self.task.done():
+            self.task = asyncio.create_task(self.run())
+
+    async def run(self):
+        # Changes made while an edit is in flight are picked up by the next window
+        while self.dirty:
+            await asyncio.sleep(config.QUEUE_EMBED_UPDATE_WINDOW)
+            self.dirty = False
+            try:
+                await self.edit()
+            except discord.HTTPException as e:
+                print(f"Error updating queue message in channel {self.channel_id}: {e}")
+
+    async def edit(self):
+        if self.message is None:
+            self.message = await self.channel.fetch_message(queues[self.channel_id]["message_id"])
+        # Only the embed changes; the persistent QueueView stays attached to the message
+        self.message = await self.message.edit(embed=create_queue_embed(self.channel_id))
+
+# Dictionary to hold the queue message updater for each channel
+queue_message_updaters = {}
+
+# Writes a channel's queue state to Supabase behind the in-memory queues dictionary, which stays authoritative
+# Rapid mutations are coalesced into one upsert of the latest state, and failed writes are retried with backoff
+class QueuePersister:
+    def __init__(self, channel_id):
+        self.channel_id = channel_id
+        self.dirty = False
+        self.task = None
+
+    def request_write(self):
+        self.dirty = True
+        if self.task is None or self.task.done():
+            self.task = asyncio.create_task(self.run())
+
+    async def run(self):
+        retry_delay = config.QUEUE_PERSIST_RETRY_DELAY
+        while self.dirty:
+            await asyncio.sleep(config.QUEUE_PERSIST_WINDOW)
+            self.dirty = False
+            try:
+                await update_queue_data(self.channel_id, queue_snapshot(self.channel_id))
+                retry_delay = config.QUEUE_PERSIST_RETRY_DELAY
+            except Exception as e:
+                print(f"Error saving queue state for channel {self.channel_id}, retrying in {retry_delay}s: {e}")
+                self.dirty = True
+                await asyncio.sleep(retry_delay)
+                retry_delay = min(retry_delay * 2, config.QUEUE_PERSIST_MAX_RETRY_DELAY)
+
+    # Function to write any pending state immediately, used on shutdown
+    async def flush(self):
+        pending = self.dirty or (self.task is not None and not self.task.done())
+        if self.task is not None:
+            self.task.cancel()
+        if pending:
+            self.dirty = False
+            try:
+                await update_queue_data(self.channel_id, queue_snapshot(self.channel_id))
+            except Exception as e:
+                print(f"Error flushing queue state for channel {self.channel_id}: {e}")
+
+# Dictionary to hold the queue state persister for each channel
+queue_persisters = {}
+
+# Function to build the row saved to the queues table for a channel
+def queue_snapshot(channel_id):
+    queue_info = queues[channel_id]
+    return {
+        "channel_id": channel_id,
+        "title": queue_info["title"],
+        "queue": list(queue_info["queue"]),
+        "max_players": queue_info["max_players"],
+        "message_id": queue_info["message_id"]
+    }
+
+# Function to schedule saving a channel's queue state; returns without waiting for the write
+def persist_queue(channel_id):
+    persister = queue_persisters.get(channel_id)
+    if persister is None:
+        persister = queue_persisters[channel_id] = QueuePersister(channel_id)
+    persister.request_write()
+
+# Function to write all pending queue state to Supabase, used on shutdown
+async def flush_queue_state():
+    await asyncio.gather(*(persister.flush() for persister in queue_persisters.values()))
+
+# Serializes every change to a channel's queue through a single consumer task
+# The queue is an insertion-ordered dictionary of user_id -> member, so membership checks are O(1)
+# Operations run one at a time in arrival order, so the queue can never overfill and each pop happens exactly once
+class QueueActor:
+    def __init__(self, channel, channel_id):
+        self.channel = channel
+        self.channel_id = channel_id
+        self.mailbox = asyncio.Queue()
+        self.task = None
+        self.stats = {
+            "processed": 0,
+            "joins": 0,
+            "leaves": 0,
+            "rejected": 0,
+            "pops": 0,
+            "peak_backlog": 0,
+            "peak_ops_per_second": 0,
+            "wait_total": 0.0,
+            "wait_max": 0.0
         }
+        # Completion times within the last QUEUE_STATS_WINDOW seconds, and the current one-second bucket
+        self.recent_completions = deque()
+        self.current_second = None
+        self.current_second_ops = 0
+
+    # Function to hand an operation to the consumer task and wait for its result
+    async def submit(self, operation, *args):
+        if self.task is None or self.task.done():
+            self.task = asyncio.create_task(self.run())
+        future = asyncio.get_running_loop().create_future()
+        enqueued_at = time.perf_counter()
+        self.mailbox.put_nowait((operation, args, future))
+        self.stats["peak_backlog"] = max(self.stats["peak_backlog"], self.mailbox.qsize())
+        try:
+            return await future
+        finally:
+            # Time from enqueue until the caller has its result, including the wait behind other operations
+            wait = time.perf_counter() - enqueued_at
+            self.stats["wait_total"] += wait
+            self.stats["wait_max"] = max(self.stats["wait_max"], wait)
+
+    async def run(self):
+        while True:
+            operation, args, future = await self.mailbox.get()
+            try:
+                result = operation(*args)
+                if not future.done():
+                    future.set_result(result)
+            except Exception as e:
+                if not future.done():
+                    future.set_exception(e)
+            finally:
+                self.record_completion()
+
+    def record_completion(self):
+        now = time.monotonic()
+        self.stats["processed"] += 1
+        self.recent_completions.append(now)
+
+        second = int(now)
+        if second != self.current_second:
+            self.current_second = second
+            self.current_second_ops = 0
+        self.current_second_ops += 1
+        self.stats["peak_ops_per_second"] = max(self.stats["peak_ops_per_second"], self.current_second_ops)
+
+    # Function to get the operations completed per second of wall-clock time over the last QUEUE_STATS_WINDOW seconds
+    def recent_throughput(self):
+        cutoff = time.monotonic() - config.QUEUE_STATS_WINDOW
+        while self.recent_completions and self.recent_completions[0] < cutoff:
+            self.recent_completions.popleft()
+        return len(self.recent_completions) / config.QUEUE_STATS_WINDOW
+
+    # Function to publish a change: save it behind the scenes and refresh the queue embed
+    def changed(self):
+        persist_queue(self.channel_id)
+        queue_message_updaters[self.channel_id].request_update()
+
+    # Returns True if the member was added, False if they were already queued
+    def join(self, member):
+        queue = queues[self.channel_id]["queue"]
+        if member.id in queue:
+            self.stats["rejected"] += 1
+            return False
+        queue[member.id] = member
+        self.stats["joins"] += 1
+        self.pop_if_full()
+        self.changed()
+        return True
+
+    # Function to add several members in one step with one save, one embed edit and one pop check
+    # Returns the number of members added; anyone already queued is skipped
+    def join_many(self, members):
+        queue = queues[self.channel_id]["queue"]
+        added = 0
+        for member in members:
+            if member.id in queue:
+                self.stats["rejected"] += 1
+                continue
+            queue[member.id] = member
+            added += 1
+        self.stats["joins"] += added
+        if added:
+            self.pop_if_full()
+            self.changed()
+        return added
+
+    # Returns True if the member was removed, False if they were not queued
+    def leave(self, member):
+        if queues[self.channel_id]["queue"].pop(member.id, None) is None:
+            self.stats["rejected"] += 1
+            return False
+        self.stats["leaves"] += 1
+        self.changed()
+        return True
+
+    def clear(self):
+        queues[self.channel_id]["queue"].clear()
+        self.changed()
+
+    # Function to take the players out of a full queue and start the match in the background
+    # A bulk join can overfill the queue, so the earliest players pop and the rest stay queued
+    def pop_if_full(self):
+        queue_info = queues[self.channel_id]
+        queue = queue_info["queue"]
+        max_players = queue_info["max_players"]
+        while len(queue) >= max_players:
+            players = [queue.pop(user_id) for user_id in list(queue)[:max_players]]
+            self.stats["pops"] += 1
+            # Keep a reference until the match has started, since the event loop only holds tasks weakly
+            task = asyncio.create_task(start_match(self.channel, self.channel_id, players))
+            match_tasks.add(task)
+            task.add_done_callback(match_tasks.discard)
 
-        # Send the initial queue message and store its ID
-        message = await channel.send(embed=create_queue_embed(info["channel_id"]), view=QueueView(info["channel_id"]))
-        queues[info["channel_id"]]["message_id"] = message.id
+# Dictionary to hold the queue actor for each channel
+queue_actors = {}
 
-# Function to delete previous bot messages in a channel
+# Set of popped matches that are still being started
+match_tasks = set()
+
+# Function to get a channel's queue actor, creating it on first use
+def get_queue_actor(channel, channel_id):
+    actor = queue_actors.get(channel_id)
+    if actor is None:
+        actor = queue_actors[channel_id] = QueueActor(channel, channel_id)
+    if channel_id not in queue_message_updaters:
+        queue_message_updaters[channel_id] = QueueMessageUpdater(channel, channel_id)
+    return actor
+
+# Function to get every pair of players who were teammates in a recent match of the game
+def get_recent_teammates(game_name):
+    return {frozenset(pair) for team in recent_teams.get(game_name, ()) for pair in combinations(team, 2)}
+
+# Function to initialize queues for each channel concurrently
+async def initialize_queues(bot, channel_info):
+    results = await asyncio.gather(*(initialize_queue(bot, info) for info in channel_info), return_exceptions=True)
+    for info, result in zip(channel_info, results):
+        if isinstance(result, Exception):
+            print(f"Error initializing queue for channel {info['channel_id']}: {result}")
+
+# Function to initialize a channel's queue, re-attaching to its existing queue message when possible
+async def initialize_queue(bot, info):
+    channel_id = info["channel_id"]
+    channel = bot.get_channel(channel_id)
+
+    # Load the queue state from Supabase if it exists
+    queue_state = await get_queue_data(channel_id)
+    queue_members = await load_queue_members(bot, channel.guild, queue_state["queue"] if queue_state else [])
+
+    # Store the queue information in the queues dictionary
+    queues[channel_id] = {
+        "title": info["title"],
+        "queue": queue_members,
+        "max_players": info["max_players"],
+        "message_id": None,
+        "organizer_id": None
+    }
+
+    # Warm start: reuse the queue message from the last run if it still exists
+    message = None
+    if queue_state and queue_state.get("message_id"):
+        try:
+            message = await channel.fetch_message(queue_state["message_id"])
+        except discord.NotFound:
+            message = None
+
+    if message is not None:
+        # Route the existing message's buttons to a fresh view and only edit it if the queue has changed
+        bot.add_view(QueueView(channel_id), message_id=message.id)
+        queues[channel_id]["message_id"] = message.id
+        queue_message_updaters[channel_id] = QueueMessageUpdater(channel, channel_id, message)
+        if not queue_embed_is_current(message, channel_id):
+            queue_message_updaters[channel_id].request_update()
+    else:
+        # Cold start: clear out old bot messages and send a new queue message
+        await delete_bot_messages(channel)
+        message = await channel.send(embed=create_queue_embed(channel_id), view=QueueView(channel_id))
+        queues[channel_id]["message_id"] = message.id
+        queue_message_updaters[channel_id] = QueueMessageUpdater(channel, channel_id, message)
+        # Save the new message ID so the next start can re-attach to it
+        persist_queue(channel_id)
+
+# Function to rebuild the queued members from saved user IDs, using the guild member cache before fetching profiles
+async def load_queue_members(bot, guild, user_ids):
+    members = {int(user_id): guild.get_member(int(user_id)) for user_id in user_ids}
+    missing = [user_id for user_id, member in members.items() if member is None]
+    if missing:
+        members.update(await get_user_profiles(bot, missing))
+    return {user_id: member for user_id, member in members.items() if member}
+
+# Function to check whether a queue message already shows the current queue
+def queue_embed_is_current(message, channel_id):
+    if not message.embeds or not message.embeds[0].fields:
+        return False
+    field = message.embeds[0].fields[0]
+    return field.name == f"{len(queues[channel_id]['queue'])} Players In Queue:" and field.value == format_queue(channel_id)
+
+# Function to reload in-flight match sessions and register their views again, so lobbies survive a restart
+async def restore_match_sessions(bot):
+    guild = bot.get_guild(config.GUILD_ID)
+    try:
+        # Abandoned lobbies are dropped rather than restored
+        expired = await delete_stale_match_sessions(config.MATCH_SESSION_TTL)
+        states = await get_match_sessions()
+    except Exception as e:
+        print(f"Error loading match sessions: {e}")
+        return
+
+    # Delete the expired lobbies' messages, since a warm start never clears the channel
+    for channel_id, message_ids in expired:
+        channel = bot.get_channel(channel_id)
+        if channel is None or not message_ids:
+            continue
+        try:
+            await delete_messages_by_id(channel, message_ids)
+        except discord.HTTPException as e:
+            print(f"Error deleting expired lobby messages in channel {channel_id}: {e}")
+    if expired:
+        print(f"Dropped {len(expired)} expired match sessions.")
+
+    for state in states:
+        session = load_session(state)
+        for view, message_id in build_session_views(session, guild):
+            bot.add_view(view, message_id=message_id)
+    print(f"Restored {len(states)} match sessions.")
+
+# Function to delete previous bot messages in a channel, keeping the messages of in-flight match sessions
+# purge deletes in bulk, falling back to single deletes only for messages older than 14 days
 async def delete_bot_messages(channel):
-    async for message in channel.history(limit=100):
-        if message.author == channel.guild.me:
-            await message.delete()
+    keep = live_session_message_ids(channel.id)
+    check = lambda message: message.author == channel.guild.me and message.id not in keep
+    try:
+        await channel.purge(limit=100, check=check)
+    except discord.Forbidden:
+        # Bulk deletion needs Manage Messages, but the bot can always delete its own messages one at a time
+        async for message in channel.history(limit=100):
+            if check(message):
+                try:
+                    await message.delete()
+                except discord.NotFound:
+                    pass
 
 # Function to create an embed for the queue status
 def create_queue_embed(channel_id):
@@ -52,66 +396,54 @@ def format_queue(channel_id):
     queue = queues[channel_id]["queue"]
     if not queue:
         return "Queue is empty."
-    return "\n".join(f"<@{member.id}>" for member in queue)
+    return "\n".join(f"<@{user_id}>" for user_id in queue)
 
 # Function to handle a user joining the queue
 async def handle_join_queue(interaction: discord.Interaction, channel_id):
-    user = interaction.user
-    await add_user_to_queue(user, channel_id, interaction.channel)
-    await interaction.response.send_message("You have joined the queue.", ephemeral=True)
+    if await add_user_to_queue(interaction.user, channel_id, interaction.channel):
+        await interaction.response.send_message("You have joined the queue.", ephemeral=True)
+    else:
+        await interaction.response.send_message("You are already in the queue.", ephemeral=True)
 
-# Function to add a user to the queue
+# Function to add a user to the queue, returns False if they were already queued
 async def add_user_to_queue(user, channel_id, interaction_channel):
-    queue_info = queues[channel_id]
-    queue = queue_info["queue"]
-    max_players = queue_info["max_players"]
-
-    if user not in queue:
-        queue.append(user)
-        # Save the updated queue state to Supabase
-        update_queue_data(channel_id, {
-            "channel_id": channel_id,
-            "title": queue_info["title"],
-            "queue": [member.id for member in queue],
-            "max_players": max_players,
-            "message_id": queue_info["message_id"]
-        })
-        await update_queue_message(interaction_channel, channel_id)
-        
-        if len(queue) == max_players:
-            await process_full_queue(interaction_channel, channel_id, queue_info)
-            queue.clear()
-            # Clear the queue state in Supabase
-            update_queue_data(channel_id, {
-                "channel_id": channel_id,
-                "title": queue_info["title"],
-                "queue": [],
-                "max_players": max_players,
-                "message_id": queue_info["message_id"]
-            })
-            await update_queue_message(interaction_channel, channel_id)
-    else:
-        # Optionally, you can send a message or log that the user is already in the queue
-        pass
+    actor = get_queue_actor(interaction_channel, channel_id)
+    return await actor.submit(actor.join, user)
+
+# Function to add several users to the queue at once, e.g. requeuing a finished lobby
+# Returns the number of users added
+async def add_users_to_queue(users, channel_id, interaction_channel):
+    actor = get_queue_actor(interaction_channel, channel_id)
+    return await actor.submit(actor.join_many, users)
+
+# Function to empty a channel's queue
+async def clear_queue(channel, channel_id):
+    actor = get_queue_actor(channel, channel_id)
+    await actor.submit(actor.clear)
 
-# Function to process the queue when it is full
-async def process_full_queue(interaction_or_channel, channel_id, queue_info):
-    queue = queue_info["queue"]
+# Function to run a popped match, logging any failure since nothing awaits it
+async def start_match(channel, channel_id, players):
+    try:
+        await process_full_queue(channel, channel_id, players)
+    except Exception as e:
+        print(f"Error starting match in channel {channel_id}: {e}")
+
+# Function to process the players popped from a full queue
+async def process_full_queue(interaction_or_channel, channel_id, queue):
+    queue_info = queues[channel_id]
     game_name = queue_info["title"].split()[0].lower()  
     
-    # Fetch player ranks from the database
+    # Fetch every player's rank and organizer flag in one lookup
+    roster = await get_roster([member.id for member in queue], game_name)
     player_ranks = []
     organizer_id = None
 
     for member in queue:
-        rank_data = get_user(str(member.id))
-        if rank_data:
-            player_ranks.append((member, rank_data.get(game_name, 0)))
-        else:
-            player_ranks.append((member, 0))
+        rank, member_is_organizer = roster[str(member.id)]
+        player_ranks.append((member, rank))
 
         # Check if the current member is an organizer
-        if not organizer_id and is_organizer(str(member.id)):
+        if not organizer_id and member_is_organizer:
             organizer_id = member.id
 
     # If no organizer is found, choose a random player as the organizer
@@ -127,70 +459,65 @@ async def process_full_queue(interaction_or_channel, channel_id, queue_info):
     else:
         channel = interaction_or_channel  # Should be a discord.TextChannel
 
+    # Remember every message posted for the match so it can be cleaned up with the lobby
+    posted_message_ids = []
+
     if organizer:
         # Send a message mentioning the organizer
-        await channel.send(f"{organizer.mention} has been designated as the organizer for this match.")
-
-    # Sort by rank in descending order
-    player_ranks.sort(key=lambda x: x[1], reverse=True)
+        organizer_message = await channel.send(f"{organizer.mention} has been designated as the organizer for this match.")
+        posted_message_ids.append(organizer_message.id)
 
-    # Distribute players into two balanced teams
-    team_a = []
-    team_b = []
-    for i, (player, rank) in enumerate(player_ranks):
-        if i % 2 == 0:
-            team_a.append((player, rank))
-        else:
-            team_b.append((player, rank))
+    # Search every split for the two most balanced teams
+    team_a, team_b = balance_teams(
+        player_ranks,
+        recent_teammates=get_recent_teammates(game_name),
+        spread_weight=config.BALANCE_SPREAD_WEIGHT,
+        repeat_weight=config.BALANCE_REPEAT_WEIGHT
+    )
 
     # Send a message with the teams
     team_a_mentions = ", ".join([member.mention for member, _ in team_a])
     team_b_mentions = ", ".join([member.mention for member, _ in team_b])
-    await channel.send(f"Match is ready!\n\n*Suggested Teams*\n**Team A:** {team_a_mentions}\n**Team B:** {team_b_mentions}")
+    ready_message = await channel.send(f"Match is ready!\n\n*Suggested Teams*\n**Team A:** {team_a_mentions}\n**Team B:** {team_b_mentions}")
+    posted_message_ids.append(ready_message.id)
+
+    # Start a match session holding only the player IDs and ratings
+    session = create_session(
+        channel_id,
+        game_name,
+        organizer_id,
+        [(member.id, rank) for member, rank in team_a],
+        [(member.id, rank) for member, rank in team_b]
+    )
 
     # Create an embed with the teams
-    embed = create_team_embed(team_a, team_b)
+    embed = create_team_embed(session.team_a, session.team_b)
 
-    # Send the embed with buttons to edit and confirm the teams, pass the organizer ID
-    await channel.send(embed=embed, view=TeamManagementView(team_a, team_b, game_name, organizer_id=organizer_id))
+    # Send the embed with buttons to edit and confirm the teams
+    message = await channel.send(embed=embed, view=TeamManagementView(session, channel.guild))
+    session.message_id = message.id
+    for message_id in posted_message_ids + [message.id]:
+        session.track_message(message_id)
+    await session.save()
 
 # Function to handle a user leaving the queue
 async def handle_leave_queue(interaction: discord.Interaction, channel_id):
-    user = interaction.user
-    queue_info = queues[channel_id]
-    queue = queue_info["queue"]
-    if user in queue:
-        queue.remove(user)
-        # Save the updated queue state to Supabase
-        update_queue_data(channel_id, {
-            "channel_id": channel_id,
-            "title": queue_info["title"],
-            "queue": [member.id for member in queue],
-            "max_players": queue_info["max_players"],
-            "message_id": queue_info["message_id"]
-        })
-        await update_queue_message(interaction.channel, channel_id)
+    actor = get_queue_actor(interaction.channel, channel_id)
+    if await actor.submit(actor.leave, interaction.user):
         await interaction.response.send_message("You have left the queue.", ephemeral=True)
     else:
         await interaction.response.send_message("You are not in the queue.", ephemeral=True)
 
-# Function to update the queue message with the current queue status
-async def update_queue_message(channel, channel_id):
-    message_id = queues[channel_id]["message_id"]
-    message = await channel.fetch_message(message_id)
-    await message.edit(embed=create_queue_embed(channel_id), view=QueueView(channel_id))
-
 # Function to handle displaying the leaderboard
 async def handle_leaderboard(interaction: discord.Interaction, channel_id):
     queue_info = queues[channel_id]
     game_name = queue_info["title"].split()[0].lower()
-    leaderboard_data = get_leaderboard(game_name)
+    leaderboard_data = await get_leaderboard(game_name)
     if not leaderboard_data:
         await interaction.response.send_message(f"No data available for the {game_name.capitalize()} leaderboard.", ephemeral=True)
     else:
+        # Mentions render as names without any profile lookups
         leaderboard_message = f"**{game_name.capitalize()} Leaderboard**\n"
         for user_id, rank in leaderboard_data:
-            user = await interaction.client.fetch_user(user_id)
-            display_name = user.global_name
-            leaderboard_message += f"{display_name}: {rank}\n"
+            leaderboard_message += f"{mention(user_id)}: {rank}\n"
         await interaction.response.send_message(leaderboard_message, ephemeral=True)
@@ -0,0 +1,109 @@
+import asyncio
+import time
+import config
+import discord
+from collections import OrderedDict
+
+# In-memory index of guild members by ID, username and global display name
+# Built from the gateway member cache and kept current by the member events in main.py
+class MemberIndex:
+    def __init__(self):
+        self.by_id = {}
+        self.by_name = {}
+        self.by_global_name = {}
+
+    # Function to rebuild the index from a full member list, e.g. guild.members
+    def build(self, members):
+        self.by_id.clear()
+        self.by_name.clear()
+        self.by_global_name.clear()
+        for member in members:
+            self.add(member)
+
+    def add(self, member):
+        self.by_id[member.id] = member
+        self.by_name[member.name] = member
+        if member.global_name:
+            self.by_global_name[member.global_name] = member
+
+    # Function to drop the name entries recorded for a member, leaving entries that now belong to someone else
+    def remove_names(self, member_id, name, global_name):
+        indexed = self.by_name.get(name)
+        if indexed is not None and indexed.id == member_id:
+            del self.by_name[name]
+        indexed = self.by_global_name.get(global_name)
+        if indexed is not None and indexed.id == member_id:
+            del self.by_global_name[global_name]
+
+    def remove(self, member):
+        self.by_id.pop(member.id, None)
+        self.remove_names(member.id, member.name, member.global_name)
+
+    # Function to re-index a member after their username or global name changed
+    def update(self, before, after):
+        self.remove_names(before.id, before.name, before.global_name)
+        self.add(after)
+
+    # Function to find a member by ID, username or global name
+    def resolve(self, identifier: str):
+        if identifier.isdigit():
+            return self.by_id.get(int(identifier))
+        return self.by_name.get(identifier) or self.by_global_name.get(identifier)
+
+member_index = MemberIndex()
+
+# Function to handle a user-level profile change (username or global name) for an indexed member
+def handle_user_update(before: discord.User, after: discord.User):
+    member = member_index.by_id.get(after.id)
+    if member is not None:
+        member_index.update(before, member)
+
+# Size-bounded LRU cache of user profiles whose entries expire after a time-to-live
+class UserCache:
+    def __init__(self, max_size, ttl):
+        self.max_size = max_size
+        self.ttl = ttl
+        self.entries = OrderedDict()
+
+    def get(self, user_id):
+        entry = self.entries.get(user_id)
+        if entry is None:
+            return None
+        user, expires_at = entry
+        if time.monotonic() > expires_at:
+            del self.entries[user_id]
+            return None
+        self.entries.move_to_end(user_id)
+        return user
+
+    def put(self, user):
+        self.entries[user.id] = (user, time.monotonic() + self.ttl)
+        self.entries.move_to_end(user.id)
+        while len(self.entries) > self.max_size:
+            self.entries.popitem(last=False)
+
+user_cache = UserCache(config.USER_CACHE_SIZE, config.USER_CACHE_TTL)
+
+# Function to get a user's profile from the gateway cache, then the profile cache, and only then over REST
+# Returns None if the user does not exist
+async def get_user_profile(bot, user_id):
+    user_id = int(user_id)
+    user = bot.get_user(user_id) or user_cache.get(user_id)
+    if user is None:
+        try:
+            user = await bot.fetch_user(user_id)
+        except discord.NotFound:
+            return None
+        user_cache.put(user)
+    return user
+
+# Function to get several profiles at once; cache misses are fetched concurrently
+# Returns a dictionary of user_id -> user (or None if the user does not exist)
+async def get_user_profiles(bot, user_ids):
+    unique_ids = list(dict.fromkeys(int(user_id) for user_id in user_ids))
+    users = await asyncio.gather(*(get_user_profile(bot, user_id) for user_id in unique_ids))
+    return dict(zip(unique_ids, users))
+
+# Function to render a mention straight from an ID, no profile lookup needed
+def mention(user_id):
+    return f"<@{user_id}>"
@@ -0,0 +1,29 @@
+-- Creates a match and links it to every participant in a single transaction.
+-- Replaces the per-player SELECT + UPDATE round trips previously made by insert_match.
+create or replace function create_match(
+    p_team1 text[],
+    p_team2 text[],
+    p_game text,
+    p_status text default 'ongoing'
+)
+returns matches.id%type
+language plpgsql
+as $$
+declare
+    new_match_id matches.id%type;
+begin
+    insert into matches (team1, team2, game, status, winner)
+    values (p_team1, p_team2, p_game, p_status, null)
+    returning id into new_match_id;
+
+    -- Append the match to every participant; the row lock taken by the upsert
+    -- means concurrent confirmations can no longer drop match IDs
+    insert into users (user_id, matches)
+    select participant, array[new_match_id]
+    from unnest(p_team1 || p_team2) as participant
+    on conflict (user_id) do update
+        set matches = array_append(coalesce(users.matches, '{}'), new_match_id);
+
+    return new_match_id;
+end;
+$$;
@@ -0,0 +1,36 @@
+-- Marks a match complete and applies every rating change in one transaction.
+-- Ratings are incremented server-side, so two lobbies finishing together cannot
+-- overwrite each other. Only the first call for a match applies; repeated calls
+-- (e.g. a double-clicked winner button) return no rows and change nothing.
+create or replace function settle_match(
+    p_match_id matches.id%type,
+    p_winner text,
+    p_game text,
+    p_winners text[],
+    p_losers text[],
+    p_delta integer default 25
+)
+returns table (user_id text, rating integer)
+language plpgsql
+as $$
+begin
+    update matches
+    set status = 'complete', winner = p_winner
+    where id = p_match_id and status is distinct from 'complete';
+
+    if not found then
+        return;
+    end if;
+
+    return query execute format(
+        'insert into users (user_id, %1$I)
+         select participant, case when participant = any($1) then $3 else -$3 end
+         from unnest($1 || $2) as participant
+         on conflict (user_id) do update
+             set %1$I = coalesce(users.%1$I, 0) + excluded.%1$I
+         returning users.user_id::text, users.%1$I::integer',
+        p_game
+    )
+    using p_winners, p_losers, p_delta;
+end;
+$$;
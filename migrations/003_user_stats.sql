@@ -0,0 +1,113 @@
+-- Materialized per-(user, game) win/loss counters so !rank reads W/L in one query.
+
+create table if not exists user_stats (
+    user_id text not null,
+    game text not null,
+    wins integer not null default 0,
+    losses integer not null default 0,
+    primary key (user_id, game)
+);
+
+-- Rebuilds every counter from the settled matches. Safe to re-run at any time.
+create or replace function rebuild_user_stats()
+returns void
+language sql
+as $$
+    delete from user_stats;
+
+    insert into user_stats (user_id, game, wins, losses)
+    select participant.user_id,
+           lower(m.game),
+           count(*) filter (where m.winner = participant.team),
+           count(*) filter (where m.winner <> participant.team)
+    from matches m
+    cross join lateral (
+        select unnest(m.team1) as user_id, 'Team A' as team
+        union all
+        select unnest(m.team2), 'Team B'
+    ) as participant
+    where m.winner is not null
+    group by participant.user_id, lower(m.game);
+$$;
+
+-- settle_match now also bumps the counters inside the same transaction.
+create or replace function settle_match(
+    p_match_id matches.id%type,
+    p_winner text,
+    p_game text,
+    p_winners text[],
+    p_losers text[],
+    p_delta integer default 25
+)
+returns table (user_id text, rating integer)
+language plpgsql
+as $$
+#variable_conflict use_column
+begin
+    update matches
+    set status = 'complete', winner = p_winner
+    where id = p_match_id and status is distinct from 'complete';
+
+    if not found then
+        return;
+    end if;
+
+    insert into user_stats as s (user_id, game, wins, losses)
+    select participant, lower(p_game),
+           case when participant = any(p_winners) then 1 else 0 end,
+           case when participant = any(p_winners) then 0 else 1 end
+    from unnest(p_winners || p_losers) as participant
+    on conflict (user_id, game) do update
+        set wins = s.wins + excluded.wins,
+            losses = s.losses + excluded.losses;
+
+    return query execute format(
+        'insert into users (user_id, %1$I)
+         select participant, case when participant = any($1) then $3 else -$3 end
+         from unnest($1 || $2) as participant
+         on conflict (user_id) do update
+             set %1$I = coalesce(users.%1$I, 0) + excluded.%1$I
+         returning users.user_id::text, users.%1$I::integer',
+        p_game
+    )
+    using p_winners, p_losers, p_delta;
+end;
+$$;
+
+-- Deletes a match, reverses its counters and removes it from the users' match arrays.
+-- Returns false when the match does not exist.
+create or replace function delete_match(p_match_id matches.id%type)
+returns boolean
+language plpgsql
+as $$
+declare
+    deleted matches%rowtype;
+begin
+    delete from matches where id = p_match_id returning * into deleted;
+
+    if not found then
+        return false;
+    end if;
+
+    if deleted.winner is not null then
+        update user_stats s
+        set wins = s.wins - case when participant.team = deleted.winner then 1 else 0 end,
+            losses = s.losses - case when participant.team = deleted.winner then 0 else 1 end
+        from (
+            select unnest(deleted.team1) as user_id, 'Team A' as team
+            union all
+            select unnest(deleted.team2), 'Team B'
+        ) as participant
+        where s.user_id = participant.user_id and s.game = lower(deleted.game);
+    end if;
+
+    update users
+    set matches = array_remove(matches, p_match_id)
+    where p_match_id = any(matches);
+
+    return true;
+end;
+$$;
+
+-- Backfill the counters from the existing match history.
+select rebuild_user_stats();
@@ -0,0 +1,142 @@
+-- Pairwise head-to-head counters keyed by (user, opponent, game) so !h2h is a single indexed lookup.
+-- Each settled match adds one row per ordered pair of opponents: the winner's row gets a win
+-- and the loser's mirrored row gets a loss.
+
+create table if not exists head_to_head (
+    user_id text not null,
+    opponent_id text not null,
+    game text not null,
+    wins integer not null default 0,
+    losses integer not null default 0,
+    primary key (user_id, opponent_id, game)
+);
+
+-- Rebuilds every head-to-head counter from the settled matches. Safe to re-run at any time.
+create or replace function rebuild_head_to_head()
+returns void
+language sql
+as $$
+    delete from head_to_head;
+
+    insert into head_to_head (user_id, opponent_id, game, wins, losses)
+    select pair.user_id,
+           pair.opponent_id,
+           lower(m.game),
+           count(*) filter (where m.winner = pair.team),
+           count(*) filter (where m.winner <> pair.team)
+    from matches m
+    cross join lateral (
+        select a.user_id, b.user_id as opponent_id, 'Team A' as team
+        from unnest(m.team1) as a(user_id), unnest(m.team2) as b(user_id)
+        union all
+        select b.user_id, a.user_id, 'Team B'
+        from unnest(m.team1) as a(user_id), unnest(m.team2) as b(user_id)
+    ) as pair
+    where m.winner is not null
+    group by pair.user_id, pair.opponent_id, lower(m.game);
+$$;
+
+-- settle_match now also records the head-to-head results inside the same transaction.
+create or replace function settle_match(
+    p_match_id matches.id%type,
+    p_winner text,
+    p_game text,
+    p_winners text[],
+    p_losers text[],
+    p_delta integer default 25
+)
+returns table (user_id text, rating integer)
+language plpgsql
+as $$
+#variable_conflict use_column
+begin
+    update matches
+    set status = 'complete', winner = p_winner
+    where id = p_match_id and status is distinct from 'complete';
+
+    if not found then
+        return;
+    end if;
+
+    insert into user_stats as s (user_id, game, wins, losses)
+    select participant, lower(p_game),
+           case when participant = any(p_winners) then 1 else 0 end,
+           case when participant = any(p_winners) then 0 else 1 end
+    from unnest(p_winners || p_losers) as participant
+    on conflict (user_id, game) do update
+        set wins = s.wins + excluded.wins,
+            losses = s.losses + excluded.losses;
+
+    insert into head_to_head as h (user_id, opponent_id, game, wins, losses)
+    select w.id, l.id, lower(p_game), 1, 0
+    from unnest(p_winners) as w(id), unnest(p_losers) as l(id)
+    union all
+    select l.id, w.id, lower(p_game), 0, 1
+    from unnest(p_winners) as w(id), unnest(p_losers) as l(id)
+    on conflict (user_id, opponent_id, game) do update
+        set wins = h.wins + excluded.wins,
+            losses = h.losses + excluded.losses;
+
+    return query execute format(
+        'insert into users (user_id, %1$I)
+         select participant, case when participant = any($1) then $3 else -$3 end
+         from unnest($1 || $2) as participant
+         on conflict (user_id) do update
+             set %1$I = coalesce(users.%1$I, 0) + excluded.%1$I
+         returning users.user_id::text, users.%1$I::integer',
+        p_game
+    )
+    using p_winners, p_losers, p_delta;
+end;
+$$;
+
+-- delete_match now also reverses the head-to-head results of a settled match.
+create or replace function delete_match(p_match_id matches.id%type)
+returns boolean
+language plpgsql
+as $$
+declare
+    deleted matches%rowtype;
+begin
+    delete from matches where id = p_match_id returning * into deleted;
+
+    if not found then
+        return false;
+    end if;
+
+    if deleted.winner is not null then
+        update user_stats s
+        set wins = s.wins - case when participant.team = deleted.winner then 1 else 0 end,
+            losses = s.losses - case when participant.team = deleted.winner then 0 else 1 end
+        from (
+            select unnest(deleted.team1) as user_id, 'Team A' as team
+            union all
+            select unnest(deleted.team2), 'Team B'
+        ) as participant
+        where s.user_id = participant.user_id and s.game = lower(deleted.game);
+
+        update head_to_head h
+        set wins = h.wins - case when pair.team = deleted.winner then 1 else 0 end,
+            losses = h.losses - case when pair.team = deleted.winner then 0 else 1 end
+        from (
+            select a.user_id, b.user_id as opponent_id, 'Team A' as team
+            from unnest(deleted.team1) as a(user_id), unnest(deleted.team2) as b(user_id)
+            union all
+            select b.user_id, a.user_id, 'Team B'
+            from unnest(deleted.team1) as a(user_id), unnest(deleted.team2) as b(user_id)
+        ) as pair
+        where h.user_id = pair.user_id
+          and h.opponent_id = pair.opponent_id
+          and h.game = lower(deleted.game);
+    end if;
+
+    update users
+    set matches = array_remove(matches, p_match_id)
+    where p_match_id = any(matches);
+
+    return true;
+end;
+$$;
+
+-- Backfill the counters from the existing match history.
+select rebuild_head_to_head();
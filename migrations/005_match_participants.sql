@@ -0,0 +1,118 @@
+-- Normalized match membership, replacing the users.matches array.
+-- match_id uses the same type as matches.id, whatever that is in this project.
+
+do $$
+begin
+    execute format(
+        'create table if not exists match_participants (
+            match_id %s not null references matches (id) on delete cascade,
+            user_id text not null,
+            team text not null,
+            game text not null,
+            created_at timestamptz not null default now(),
+            primary key (match_id, user_id)
+        )',
+        (
+            select format_type(atttypid, atttypmod)
+            from pg_attribute
+            where attrelid = 'matches'::regclass and attname = 'id'
+        )
+    );
+end;
+$$;
+
+-- Serves a user's history newest-first without touching other users' rows
+create index if not exists match_participants_user_created_idx
+    on match_participants (user_id, created_at desc, match_id desc);
+
+-- Backfill from the existing users.matches arrays
+insert into match_participants (match_id, user_id, team, game, created_at)
+select m.id,
+       u.user_id,
+       case when u.user_id = any(m.team1) then 'Team A' else 'Team B' end,
+       lower(m.game),
+       m.created_at
+from users u
+cross join lateral unnest(u.matches) as user_match(match_id)
+join matches m on m.id = user_match.match_id
+on conflict do nothing;
+
+-- create_match writes participant rows instead of rewriting every player's array.
+create or replace function create_match(
+    p_team1 text[],
+    p_team2 text[],
+    p_game text,
+    p_status text default 'ongoing'
+)
+returns matches.id%type
+language plpgsql
+as $$
+declare
+    new_match matches%rowtype;
+begin
+    insert into matches (team1, team2, game, status, winner)
+    values (p_team1, p_team2, p_game, p_status, null)
+    returning * into new_match;
+
+    insert into users (user_id)
+    select participant
+    from unnest(p_team1 || p_team2) as participant
+    on conflict (user_id) do nothing;
+
+    insert into match_participants (match_id, user_id, team, game, created_at)
+    select new_match.id, participant, 'Team A', lower(p_game), new_match.created_at
+    from unnest(p_team1) as participant
+    union all
+    select new_match.id, participant, 'Team B', lower(p_game), new_match.created_at
+    from unnest(p_team2) as participant;
+
+    return new_match.id;
+end;
+$$;
+
+-- delete_match no longer scans users; participant rows go with the match via the foreign key.
+create or replace function delete_match(p_match_id matches.id%type)
+returns boolean
+language plpgsql
+as $$
+declare
+    deleted matches%rowtype;
+begin
+    delete from matches where id = p_match_id returning * into deleted;
+
+    if not found then
+        return false;
+    end if;
+
+    if deleted.winner is not null then
+        update user_stats s
+        set wins = s.wins - case when participant.team = deleted.winner then 1 else 0 end,
+            losses = s.losses - case when participant.team = deleted.winner then 0 else 1 end
+        from (
+            select unnest(deleted.team1) as user_id, 'Team A' as team
+            union all
+            select unnest(deleted.team2), 'Team B'
+        ) as participant
+        where s.user_id = participant.user_id and s.game = lower(deleted.game);
+
+        update head_to_head h
+        set wins = h.wins - case when pair.team = deleted.winner then 1 else 0 end,
+            losses = h.losses - case when pair.team = deleted.winner then 0 else 1 end
+        from (
+            select a.user_id, b.user_id as opponent_id, 'Team A' as team
+            from unnest(deleted.team1) as a(user_id), unnest(deleted.team2) as b(user_id)
+            union all
+            select b.user_id, a.user_id, 'Team B'
+            from unnest(deleted.team1) as a(user_id), unnest(deleted.team2) as b(user_id)
+        ) as pair
+        where h.user_id = pair.user_id
+          and h.opponent_id = pair.opponent_id
+          and h.game = lower(deleted.game);
+    end if;
+
+    return true;
+end;
+$$;
+
+-- The array is fully replaced by match_participants
+alter table users drop column if exists matches;
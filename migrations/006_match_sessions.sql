@@ -0,0 +1,9 @@
+-- In-flight match lobbies (team management through requeue), so their buttons keep working across restarts.
+-- state holds the serialized MatchSession: player IDs and ratings, stage, match ID and message IDs.
+
+create table if not exists match_sessions (
+    session_id text primary key,
+    channel_id bigint not null,
+    state jsonb not null,
+    updated_at timestamptz not null default now()
+);
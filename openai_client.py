@@ -1,13 +1,150 @@
+import asyncio
+import itertools
+import time
 import config
-from openai import OpenAI
+from collections import deque
+from openai import AsyncOpenAI
 
-client = OpenAI(api_key=config.OPENAI_KEY)
+client = AsyncOpenAI(api_key=config.OPENAI_KEY)
 
-# Initialize an empty conversation history
-conversation_history = []
+# Function to roughly estimate the tokens in a message (about four characters per token plus per-message overhead)
+def estimate_tokens(content):
+    return len(content or "") // 4 + 4
 
-def gpt_response(prompt, user_name="", response_type="general", original_message=None):
-    print(f"Prompt: {prompt}, User Name: {user_name}, Response Type: {response_type}, Original Message: {original_message}")
+# Bounded conversation memory for a single channel
+# Holds a fixed-size deque of messages that is also trimmed to a token budget
+class ChannelConversation:
+    def __init__(self):
+        self.messages = deque(maxlen=config.CONVERSATION_MAX_MESSAGES)
+        self.token_count = 0
+        self.last_used = time.monotonic()
+
+    def append(self, role, content):
+        # A full deque drops its oldest message on append, so stop counting that message's tokens
+        if len(self.messages) == self.messages.maxlen:
+            self.token_count -= estimate_tokens(self.messages[0]["content"])
+        self.messages.append({"role": role, "content": content})
+        self.token_count += estimate_tokens(content)
+        self.last_used = time.monotonic()
+
+        # Drop the oldest messages until the history fits the token budget
+        while self.messages and self.token_count > config.CONVERSATION_TOKEN_BUDGET:
+            self.token_count -= estimate_tokens(self.messages.popleft()["content"])
+
+    # Function to build the smallest request for a completion: the system prompt followed by the history
+    def build_request(self, system_prompt):
+        return [{"role": "system", "content": system_prompt}, *self.messages]
+
+# Dictionary to hold the conversation for each channel
+conversations = {}
+last_eviction = time.monotonic()
+
+# Function to get a channel's conversation, evicting conversations that have been idle for too long
+def get_conversation(channel_id):
+    global last_eviction
+    now = time.monotonic()
+    if now - last_eviction > config.CONVERSATION_IDLE_TIMEOUT:
+        last_eviction = now
+        for idle_channel_id in [cid for cid, conversation in conversations.items() if now - conversation.last_used > config.CONVERSATION_IDLE_TIMEOUT]:
+            del conversations[idle_channel_id]
+
+    conversation = conversations.get(channel_id)
+    if conversation is None:
+        conversation = conversations[channel_id] = ChannelConversation()
+    return conversation
+
+# Priorities for queued completions, lower values are served first
+PRIORITY_COMMAND = 0  # explicit !vantas requests
+PRIORITY_REPLY = 1    # replies to the bot
+PRIORITY_KEYWORD = 2  # keyword triggers such as genji or mercy
+PRIORITY_CHAT = 3     # random chatter, shed first when the queue is deep
+
+PRIORITY_BACKGROUND = 4  # pre-generating pooled responses
+
+RESPONSE_PRIORITIES = {
+    "general": PRIORITY_COMMAND,
+    "reply": PRIORITY_REPLY,
+    "chat": PRIORITY_CHAT,
+}
+
+# Bounded pool of workers consuming a priority queue of completion requests, started on first use
+request_queue = None
+workers = []
+request_counter = itertools.count()
+
+# Function to start the completion workers on the running event loop
+def start_workers():
+    global request_queue
+    if request_queue is None:
+        request_queue = asyncio.PriorityQueue()
+        for _ in range(config.OPENAI_MAX_CONCURRENCY):
+            workers.append(asyncio.create_task(completion_worker()))
+
+# Function run by each worker: take the most urgent request and resolve its future with the completion
+async def completion_worker():
+    while True:
+        _, _, messages, on_update, future = await request_queue.get()
+        try:
+            # Skip requests whose caller has already given up
+            if future.done():
+                continue
+            if on_update is None:
+                chat_completion = await client.chat.completions.create(
+                    messages=messages,
+                    model="gpt-4o-mini",
+                )
+                message = chat_completion.choices[0].message.content
+            else:
+                message = await stream_completion(messages, on_update, future)
+            if not future.done():
+                future.set_result(message)
+        except Exception as e:
+            if not future.done():
+                future.set_exception(e)
+        finally:
+            request_queue.task_done()
+
+# Function to stream a completion, passing the text received so far to on_update as tokens arrive
+async def stream_completion(messages, on_update, future):
+    # Signal that the request is being processed so the caller can show a placeholder
+    await on_update("")
+
+    stream = await client.chat.completions.create(
+        messages=messages,
+        model="gpt-4o-mini",
+        stream=True,
+    )
+    parts = []
+    async for chunk in stream:
+        # Stop streaming if the caller has given up, e.g. after missing its deadline
+        if future.done():
+            break
+        content = chunk.choices[0].delta.content if chunk.choices else None
+        if content:
+            parts.append(content)
+            await on_update("".join(parts))
+    return "".join(parts)
+
+# Function to queue a completion request and wait for the result
+# If on_update is given the completion is streamed and on_update is awaited with the text received so far
+# Returns None if the request was shed because the queue is too deep
+# Raises asyncio.TimeoutError if a deadline is given and the completion does not arrive in time
+async def request_completion(messages, priority, deadline=None, on_update=None):
+    start_workers()
+
+    depth = request_queue.qsize()
+    if depth >= config.OPENAI_MAX_QUEUE_DEPTH or (priority >= PRIORITY_CHAT and depth >= config.OPENAI_SHED_QUEUE_DEPTH):
+        print(f"Shedding completion request with priority {priority}, queue depth {depth}")
+        return None
+
+    future = asyncio.get_running_loop().create_future()
+    request_queue.put_nowait((priority, next(request_counter), messages, on_update, future))
+    if deadline is None:
+        return await future
+    return await asyncio.wait_for(future, deadline)
+
+# Function to build the persona's system instructions for a response type
+def build_system_instructions(response_type):
     # Define specific instructions based on the response type
     if response_type == "chat":
         specific_instructions = "Provide a response that starts with something loosely related to the user's message but quickly diverges into unhinged, conspiracy-esque nonsense. Feel free to address the user directly, make wild claims, and be crass or offensive. Three sentences maximum."
@@ -39,50 +176,108 @@ def gpt_response(prompt, user_name="", response_type="general", original_message
     Specific Instructions:
     {specific_instructions}
     """
+    return system_instructions
 
-    global conversation_history
+async def gpt_response(prompt, user_name="", response_type="general", original_message=None, channel_id=None, on_update=None):
+    print(f"Prompt: {prompt}, User Name: {user_name}, Response Type: {response_type}, Original Message: {original_message}")
+    system_instructions = build_system_instructions(response_type)
 
-    # Update the system instructions
-    conversation_history.insert(0, {"role": "system", "content": system_instructions})
+    conversation = get_conversation(channel_id)
 
     # Add the original message and user message to the conversation history
     if original_message:
-        conversation_history.append({"role": "assistant", "content": original_message})
-    conversation_history.append({"role": "user", "content": f"{user_name}: {prompt}"})
+        conversation.append("assistant", original_message)
+    conversation.append("user", f"{user_name}: {prompt}")
 
-    # Limit the conversation history to the last 50 messages
-    if len(conversation_history) > 50:
-        conversation_history = conversation_history[-50:]
+    priority = RESPONSE_PRIORITIES.get(response_type, PRIORITY_KEYWORD)
+    deadline = config.OPENAI_COMMAND_DEADLINE if priority == PRIORITY_COMMAND else None
 
     try:
-        # Create the chat completion
-        chat_completion = client.chat.completions.create(
-            messages=conversation_history,
-            model="gpt-4o-mini",
-        )
-        
-        # Get the response message
-        message = chat_completion.choices[0].message.content
+        # Queue the chat completion and wait for the response message
+        message = await request_completion(conversation.build_request(system_instructions), priority, deadline, on_update)
 
-        # Append the assistant's response to the conversation history
-        conversation_history.append({"role": "assistant", "content": message})
+        # The request was shed, so there is nothing to send
+        if message is None:
+            return None
 
-         # Limit the conversation history to the last 50 messages
-        if len(conversation_history) > 50:
-            conversation_history = conversation_history[-50:]
+        # Append the assistant's response to the conversation history
+        conversation.append("assistant", message)
 
+    except asyncio.TimeoutError:
+        message = "Sorry, that took too long. Try again in a bit."
+        print(f"Completion for response type {response_type} missed its {deadline}s deadline")
     except Exception as e:
         message = "Sorry, something went wrong with the response."
         print(f"Error: {e}")
 
     return message
 
-def store_message(message_content, user_name):
-    global conversation_history
+def store_message(message_content, user_name, channel_id=None):
+    # Store the general message in the channel's conversation history
+    get_conversation(channel_id).append("user", f"{user_name}: {message_content}")
+
+# Pool of pre-generated replies for a keyword trigger, served round-robin and refilled in the background
+# Each reply expires after RESPONSE_POOL_TTL seconds so the pool keeps turning over
+class ResponsePool:
+    def __init__(self, response_type):
+        self.response_type = response_type
+        self.responses = deque()
+        self.refill_task = None
+
+    def evict_expired(self):
+        now = time.monotonic()
+        self.responses = deque((text, expires_at) for text, expires_at in self.responses if expires_at > now)
+
+    # Function to serve the next pooled reply, or None if the pool is empty
+    def take(self):
+        self.evict_expired()
+        if len(self.responses) < config.RESPONSE_POOL_SIZE:
+            self.schedule_refill()
+        if not self.responses:
+            return None
+
+        # Rotate the reply to the back so replies are served round-robin
+        response = self.responses.popleft()
+        self.responses.append(response)
+        return response[0]
+
+    def schedule_refill(self):
+        if self.refill_task is None or self.refill_task.done():
+            self.refill_task = asyncio.create_task(self.refill())
+
+    # Function to generate replies until the pool is full, at background priority
+    async def refill(self):
+        messages = [
+            {"role": "system", "content": build_system_instructions(self.response_type)},
+            {"role": "user", "content": f"Someone: {self.response_type}"},
+        ]
+        try:
+            while len(self.responses) < config.RESPONSE_POOL_SIZE:
+                response = await request_completion(messages, PRIORITY_BACKGROUND)
+                if not response:
+                    # Shed because the queue is busy; try again on the next take
+                    return
+                self.responses.append((response, time.monotonic() + config.RESPONSE_POOL_TTL))
+        except Exception as e:
+            print(f"Error refilling {self.response_type} response pool: {e}")
+
+# Dictionary to hold the response pool for each pooled keyword response type
+response_pools = {}
 
-    # Store the general message in the conversation history
-    conversation_history.append({"role": "user", "content": f"{user_name}: {message_content}"})
+# Function to start filling the response pools in the background, used at startup
+def warm_response_pools():
+    for response_type in config.POOLED_RESPONSE_TYPES:
+        if response_type not in response_pools:
+            response_pools[response_type] = ResponsePool(response_type)
+            response_pools[response_type].schedule_refill()
 
-    # Limit the conversation history to the last 50 messages
-    if len(conversation_history) > 50:
-        conversation_history = conversation_history[-50:]
\ No newline at end of file
+# Function to get a pooled reply for a keyword trigger, recording it in the channel's conversation
+# Returns None if the response type is not pooled or its pool is still empty
+def pooled_response(prompt, user_name, response_type, channel_id=None):
+    pool = response_pools.get(response_type)
+    response = pool.take() if pool else None
+    if response:
+        conversation = get_conversation(channel_id)
+        conversation.append("user", f"{user_name}: {prompt}")
+        conversation.append("assistant", response)
+    return response
@@ -1,44 +1,41 @@
+import asyncio
+import time
 import config
+from concurrent.futures import ThreadPoolExecutor
 from supabase import create_client, Client
 from datetime import datetime, timedelta, timezone
+from leaderboard import LeaderboardIndex
 
 url = config.SUPABASE_URL
 key = config.SUPABASE_KEY
 supabase: Client = create_client(url, key) # type: ignore # type: ignore
 
-# Function to update the rank (score) of a user in a specific game based on the action (win or lose)
-def update_rank(user_id: str, game_name: str, action: str):
-    print(f"Updating rank for user_id: {user_id}, game_name: {game_name}, action: {action}")
+# Bounded pool that runs the blocking PostgREST round trips off the event loop
+executor = ThreadPoolExecutor(max_workers=config.SUPABASE_MAX_WORKERS, thread_name_prefix="supabase")
 
-    # Determine the change in score based on the action
-    score_change = 25 if action == "win" else -25
+# Function to execute a query in the executor so a slow request never blocks the gateway
+async def execute(query):
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(executor, query.execute)
 
-    # Fetch the current rank of the user for the game
-    response = supabase.table('users').select(game_name).eq('user_id', user_id).execute()
+# Dictionary to hold the in-memory leaderboard index for each game
+leaderboards = {}
 
-    if len(response.data) == 0: 
-        # Insert new user data
-        new_data = { "user_id": user_id, game_name: score_change }
-        supabase.table('users').insert(new_data).execute()
-    else:
-        # Update existing user data
-        current_rank = response.data[0][game_name] if game_name in response.data[0] else 0
-        new_rank = current_rank + score_change
-        supabase.table('users').update({ game_name: new_rank }).eq('user_id', user_id).execute()
+# Function to apply a rating change to a game's leaderboard index if it has been loaded
+def update_leaderboard_index(game_name: str, user_id: str, rating):
+    leaderboard = leaderboards.get(game_name)
+    if leaderboard is not None:
+        leaderboard.set(user_id, rating)
+
+# Function to load a game's leaderboard from Supabase into its in-memory index
+# Returns None for anything that is not a configured game, so other users columns are never indexed
+async def load_leaderboard(game_name: str):
+    if game_name not in config.GAMES:
+        return None
 
-# Function to get the leaderboard for a specific game
-def get_leaderboard(game_name: str):
     try:
         # Attempt to select the column associated with the game_name
-        response = supabase.table('users').select('user_id', game_name).order(game_name, desc=True).execute()
-        
-        # Check if there is any data returned
-        if not response.data:
-            return None
-        
-        # Process the data if available
-        leaderboard_data = [(record['user_id'], record[game_name]) for record in response.data]
-        return leaderboard_data
+        response = await execute(supabase.table('users').select('user_id', game_name).not_.is_(game_name, 'null'))
     except Exception as e:
         # Handle the case where the column does not exist
         if 'column' in str(e) and 'does not exist' in str(e):
@@ -46,52 +43,111 @@ def get_leaderboard(game_name: str):
         else:
             # Re-raise the exception if it's something unexpected
             raise e
+
+    leaderboard = LeaderboardIndex((record['user_id'], record[game_name]) for record in response.data)
+    leaderboards[game_name] = leaderboard
+    return leaderboard
+
+# Function to load the leaderboards for several games concurrently, used at startup
+async def load_leaderboards(game_names):
+    await asyncio.gather(*(load_leaderboard(game_name) for game_name in game_names))
+
+# Function to get the leaderboard for a specific game
+# Returns a LeaderboardIndex sorted by rating that supports len(), iteration and slicing by page
+async def get_leaderboard(game_name: str):
+    leaderboard = leaderboards.get(game_name)
+    if leaderboard is None:
+        leaderboard = await load_leaderboard(game_name)
+
+    # Check if there is any data available
+    if not leaderboard:
+        return None
+    return leaderboard
         
-def get_user_leaderboard_position(game_name: str, user_id: str):
-    leaderboard_data = get_leaderboard(game_name)
+async def get_user_leaderboard_position(game_name: str, user_id: str):
+    leaderboard_data = await get_leaderboard(game_name)
     
     if leaderboard_data is None:
         print(f"Debug: No leaderboard data found for game '{game_name}'")
         return None, None
 
-    for position, (uid, mmr) in enumerate(leaderboard_data, start=1):
-        if uid == user_id:
-            return position, mmr
-    
-    return None, None
+    return leaderboard_data.position(user_id)
 
-def get_user(user_id: str):
-    response = supabase.table('users').select('*').eq('user_id', user_id).execute()
+async def get_user(user_id: str):
+    response = await execute(supabase.table('users').select('*').eq('user_id', user_id))
     return response.data[0] if response.data else None
 
-def clear_rank(user_id: str):
+# Function to count the matches a user has played
+async def get_match_count(user_id: str):
+    response = await execute(supabase.table('match_participants').select('match_id', count='exact').eq('user_id', user_id).limit(1))
+    return response.count or 0
+
+# Function to get one page of a user's match history, newest first, in a single query
+# Pass the (created_at, match_id) of the last match on the previous page as `after` for keyset pagination,
+# or an offset to jump straight to a page that has not been reached yet
+async def get_match_history(user_id: str, limit: int = 10, after=None, offset: int = 0):
+    query = (
+        supabase.table('match_participants')
+        .select('match_id', 'team', 'created_at', 'matches(game, winner, map, replay)')
+        .eq('user_id', user_id)
+    )
+    if after:
+        created_at, match_id = after
+        query = query.or_(f'created_at.lt."{created_at}",and(created_at.eq."{created_at}",match_id.lt.{match_id})')
+    query = query.order('created_at', desc=True).order('match_id', desc=True)
+    if after:
+        query = query.limit(limit)
+    else:
+        query = query.range(offset, offset + limit - 1)
+    response = await execute(query)
+
+    history = []
+    for record in response.data:
+        match_data = record['matches'] or {}
+        history.append({
+            "match_id": record['match_id'],
+            "team": record['team'],
+            "created_at": record['created_at'],
+            "game": match_data.get("game", ""),
+            "winner": match_data.get("winner"),
+            "map": match_data.get("map"),
+            "replay": match_data.get("replay")
+        })
+    return history
+
+async def clear_rank(user_id: str):
     # Set all game columns to 0 for the specified user
-    supabase.table('users').update({
+    cleared_ranks = {
         'overwatch': 0,
         'league': 0,
         # Add more game columns as needed
-    }).eq('user_id', user_id).execute()
+    }
+    response = await execute(supabase.table('users').update(cleared_ranks).eq('user_id', user_id))
+    if response.data:
+        for game_name, rank in cleared_ranks.items():
+            update_leaderboard_index(game_name, user_id, rank)
 
-def set_rank(user_id: str, game_name: str, rank: int):
-    supabase.table('users').upsert({
+async def set_rank(user_id: str, game_name: str, rank: int):
+    await execute(supabase.table('users').upsert({
         'user_id': user_id,
         game_name: rank
-    }).execute()
+    }))
+    update_leaderboard_index(game_name, user_id, rank)
     
 # Function to get queue data
-def get_queue_data(channel_id):
-    response = supabase.table('queues').select('*').eq('channel_id', channel_id).execute()
+async def get_queue_data(channel_id):
+    response = await execute(supabase.table('queues').select('*').eq('channel_id', channel_id))
     return response.data[0] if response.data else None
 
 # Function to update queue data
-def update_queue_data(channel_id, data):
-    response = supabase.table('queues').upsert(data).execute()
+async def update_queue_data(channel_id, data):
+    response = await execute(supabase.table('queues').upsert(data))
     return response
 
-def increment_ping_if_due(bot):
+async def increment_ping_if_due(bot):
     try:
         # Fetch the latest ping record
-        response = supabase.table('ping').select('*').order('updated_at', desc=True).limit(1).execute()
+        response = await execute(supabase.table('ping').select('*').order('updated_at', desc=True).limit(1))
 
         if response.data:
             ping_record = response.data[0]
@@ -102,76 +158,79 @@ def increment_ping_if_due(bot):
             if current_time > updated_at + timedelta(days=1):
                 # Update the ping count and updated_at timestamp
                 new_ping_value = ping_record['ping'] + 1
-                supabase.table('ping').update({
+                await execute(supabase.table('ping').update({
                     'ping': new_ping_value,
                     'updated_at': 'now()',
-                }).eq('id', ping_record['id']).execute()
+                }).eq('id', ping_record['id']))
                 print(f"Ping incremented to {new_ping_value} and updated_at set to current time.")
             else:
                 print("Less than a day has passed since the last update. No update necessary.")
         else:
             # No records exist, so insert a new record
-            supabase.table('ping').insert({
+            await execute(supabase.table('ping').insert({
                 'ping': 1,
                 'created_at': 'now()',
                 'updated_at': 'now()'
-            }).execute()
+            }))
             print("No records found. New ping record created with ping = 1.")
 
     except Exception as e:
         print(f"Error updating ping: {e}")
 
-# Function to insert a new match into the matches table
-def insert_match(team1: list, team2: list, game: str, status: str = "ongoing"):
-    new_match = {
-        "team1": team1,
-        "team2": team2,
-        "game": game,
-        "status": status,
-        "winner": None
-    }
-    response = supabase.table('matches').insert(new_match).execute()
-    
-    if response.data:
-        match_id = response.data[0]["id"]
-
-        # Update the matches column for each user in both teams
-        for user_id in team1 + team2:
-            update_user_matches(user_id, match_id)
-        
-        return match_id
-    return None
-
-# Function to update the match as complete and set the winner
-def update_match(match_id: str, winner: str):
-    response = supabase.table('matches').update({
-        "status": "complete",
-        "winner": winner
-    }).eq('id', match_id).execute()
+# Function to insert a new match and link it to every player in one round trip (see migrations/001_create_match.sql)
+async def insert_match(team1: list, team2: list, game: str, status: str = "ongoing"):
+    response = await execute(supabase.rpc('create_match', {
+        "p_team1": team1,
+        "p_team2": team2,
+        "p_game": game,
+        "p_status": status
+    }))
+    return response.data if response.data else None
+
+# Function to mark the match complete, set the winner and apply every rating change in one transaction
+# Returns the new ratings of the players, or an empty list if the match had already been settled
+async def update_match(match_id: str, winner: str, game_name: str, winners: list, losers: list):
+    response = await execute(supabase.rpc('settle_match', {
+        "p_match_id": match_id,
+        "p_winner": winner,
+        "p_game": game_name,
+        "p_winners": winners,
+        "p_losers": losers
+    }))
+    for record in response.data or []:
+        update_leaderboard_index(game_name, record['user_id'], record['rating'])
+    return response.data or []
+
+# Function to save an in-flight match session (see migrations/006_match_sessions.sql)
+async def save_match_session(session_id: str, channel_id: int, state: dict):
+    response = await execute(supabase.table('match_sessions').upsert({
+        "session_id": session_id,
+        "channel_id": channel_id,
+        "state": state,
+        "updated_at": datetime.now(timezone.utc).isoformat()
+    }))
     return response
 
-def update_user_matches(user_id: str, match_id: str):
-    # Fetch the current matches array for the user
-    response = supabase.table('users').select('matches').eq('user_id', user_id).execute()
-    
-    if len(response.data) == 0:
-        # Insert new user data with the match ID
-        new_data = {"user_id": user_id, "matches": [match_id]}
-        supabase.table('users').insert(new_data).execute()
-    else:
-        current_matches = response.data[0].get('matches', [])
-        if current_matches is None:
-            current_matches = []
+# Function to remove a match session once its lobby is finished
+async def delete_match_session(session_id: str):
+    response = await execute(supabase.table('match_sessions').delete().eq('session_id', session_id))
+    return response
 
-        # Append the new match ID
-        updated_matches = current_matches + [match_id]
+# Function to delete match sessions that have not changed for max_age seconds
+# Returns a list of (channel_id, message_ids) for the removed sessions so their messages can be cleaned up
+async def delete_stale_match_sessions(max_age: int):
+    cutoff = (datetime.now(timezone.utc) - timedelta(seconds=max_age)).isoformat()
+    response = await execute(supabase.table('match_sessions').delete().lt('updated_at', cutoff))
+    return [(row['channel_id'], row['state'].get('message_ids') or []) for row in response.data or []]
 
-        # Update the user's matches array
-        supabase.table('users').update({"matches": updated_matches}).eq('user_id', user_id).execute()
+# Function to load every in-flight match session, used at startup
+async def get_match_sessions():
+    response = await execute(supabase.table('match_sessions').select('state'))
+    return [row['state'] for row in response.data or []]
 
 # Function to get match details, including the replay code
-def get_match_details(match_id: str):
-    response = supabase.table('matches').select('*').eq('id', match_id).execute()
+async def get_match_details(match_id: str):
+    response = await execute(supabase.table('matches').select('*').eq('id', match_id))
     if response.data:
         match_data = response.data[0]
         return {
@@ -186,189 +245,136 @@ def get_match_details(match_id: str):
     return None
 
 # Function to update the replay code for a specific match
-def update_replay_code(match_id: str, replay_code: str):
-    response = supabase.table('matches').update({
+async def update_replay_code(match_id: str, replay_code: str):
+    response = await execute(supabase.table('matches').update({
         "replay": replay_code
-    }).eq('id', match_id).execute()
+    }).eq('id', match_id))
     return response
 
-# Function to check if a user is an organizer
-def is_organizer(user_id: str):
-    response = supabase.table('organizers').select('users').execute()
-    if response.data:
-        for record in response.data:
-            if user_id in record['users']:
-                return True
-    return False
+# Cached set of organizer user IDs, reloaded once it is older than ORGANIZER_CACHE_TTL seconds
+organizer_cache = {"users": set(), "loaded_at": None}
+
+# Function to reload the organizer set from Supabase, also used when an admin changes the organizers
+async def refresh_organizers():
+    response = await execute(supabase.table('organizers').select('users'))
+    organizers = set()
+    for record in response.data:
+        organizers.update(str(user_id) for user_id in record['users'] or [])
+    organizer_cache["users"] = organizers
+    organizer_cache["loaded_at"] = time.monotonic()
+    return organizers
+
+# Function to get the organizer set, refreshing it if the cache has expired
+async def get_organizers():
+    loaded_at = organizer_cache["loaded_at"]
+    if loaded_at is None or time.monotonic() - loaded_at > config.ORGANIZER_CACHE_TTL:
+        return await refresh_organizers()
+    return organizer_cache["users"]
+
+# Function to get every queued player's rating for a game and organizer flag in one query
+# Returns a dictionary of user_id -> (rating, is_organizer)
+async def get_roster(user_ids: list, game_name: str):
+    user_ids = [str(user_id) for user_id in user_ids]
+    response, organizers = await asyncio.gather(
+        execute(supabase.table('users').select('*').in_('user_id', user_ids)),
+        get_organizers()
+    )
+    ratings = {record['user_id']: record.get(game_name) or 0 for record in response.data}
+    return {user_id: (ratings.get(user_id, 0), user_id in organizers) for user_id in user_ids}
 
 # Function to get the map pool for a specific game
-def get_map_pool(game_name: str):
-    response = supabase.table('maps').select('map_pool').eq('id', game_name).execute()
+async def get_map_pool(game_name: str):
+    response = await execute(supabase.table('maps').select('map_pool').eq('id', game_name))
     if response.data:
         return response.data[0]['map_pool']
     return []
 
 # Function to update the map for a specific match
-def update_match_map(match_id: str, map_name: str):
-    response = supabase.table('matches').update({
+async def update_match_map(match_id: str, map_name: str):
+    response = await execute(supabase.table('matches').update({
         "map": map_name
-    }).eq('id', match_id).execute()
+    }).eq('id', match_id))
     return response
 
 # Function to clear all active queues
 async def clear_all_queues(bot):
-    from matchmaking import queues, update_queue_message
+    from matchmaking import queues, clear_queue
     for channel_info in config.CHANNEL_INFO:
         channel_id = channel_info['channel_id']
-        queue_info = queues.get(channel_id)
-        
-        if queue_info:
-            # Clear the in-memory queue
-            queue_info["queue"].clear()
-
-            # Update the queue state in Supabase
-            update_queue_data(channel_id, {
-                "channel_id": channel_id,
-                "title": queue_info["title"],
-                "queue": [],
-                "max_players": queue_info["max_players"],
-                "message_id": queue_info["message_id"]
-            })
-
-            channel = bot.get_channel(channel_id)
-            await update_queue_message(channel, channel_id)
+        if channel_id in queues:
+            # Clear the in-memory queue; the queue state and message are updated in the background
+            await clear_queue(bot.get_channel(channel_id), channel_id)
 
     print("All active queues have been cleared.")
 
 # Function to clear the replay codes for all matches
-def clear_all_replays():
+async def clear_all_replays():
     try:
         # Set the replay column to NULL (or None in Python) for all matches
-        supabase.table('matches').update({
+        await execute(supabase.table('matches').update({
             "replay": None
-        }).execute()
+        }))
         print("All replay codes have been cleared.")
     except Exception as e:
         print(f"Error clearing replay codes: {e}")
 
-def get_wins_and_losses(user_id: str):
-    # Fetch all match IDs associated with the user
-    user_data = supabase.table('users').select('matches').eq('user_id', user_id).execute()
+# Function to get a user's wins and losses for each game from the materialized counters
+async def get_wins_and_losses(user_id: str):
+    response = await execute(supabase.table('user_stats').select('game', 'wins', 'losses').eq('user_id', user_id))
 
-    if not user_data.data:
-        return None
-
-    matches = user_data.data[0].get('matches', [])
-    if not matches:
-        return None
-
-    wins_losses = {}
-
-    # Iterate through each match to determine win/loss
-    for match_id in matches:
-        match_data = supabase.table('matches').select('*').eq('id', match_id).execute()
-
-        if not match_data.data:
-            continue
-
-        match = match_data.data[0]
-
-        # Determine if the user was on Team A or Team B
-        if user_id in match['team1']:
-            user_team = 'Team A'
-        elif user_id in match['team2']:
-            user_team = 'Team B'
-        else:
-            continue  # User was not part of this match
-
-        # Check which team won and update the wins/losses count
-        game_name = match['game'].lower()
-        if game_name not in wins_losses:
-            wins_losses[game_name] = {'wins': 0, 'losses': 0}
-
-        if match['winner'] == user_team:
-            wins_losses[game_name]['wins'] += 1
-        else:
-            wins_losses[game_name]['losses'] += 1
-
-    return wins_losses
-
-def delete_match(match_id: str):
-    try:
-        # Delete the match from the matches table
-        supabase.table('matches').delete().eq('id', match_id).execute()
-
-        # Fetch all users that have the match_id in their matches array
-        users_with_match = supabase.table('users').select('user_id', 'matches').execute()
-
-        # Iterate through users and update their matches array
-        for user in users_with_match.data:
-            if match_id in user['matches']:
-                updated_matches = [mid for mid in user['matches'] if mid != match_id]
-
-                # Update the user's matches array
-                supabase.table('users').update({'matches': updated_matches}).eq('user_id', user['user_id']).execute()
+    return {
+        record['game']: {'wins': record['wins'], 'losses': record['losses']}
+        for record in response.data
+    }
 
-        print(f"Match {match_id} and associated references in user matches have been deleted.")
-    
-    except Exception as e:
-        print(f"Error deleting match {match_id}: {e}")
+# Function to rebuild the win/loss and head-to-head counters from the existing match history
+async def rebuild_wins_and_losses():
+    await asyncio.gather(
+        execute(supabase.rpc('rebuild_user_stats', {})),
+        execute(supabase.rpc('rebuild_head_to_head', {}))
+    )
+    print("Win/loss and head-to-head counters have been rebuilt from match history.")
+
+# Function to delete a match along with its participants and win/loss counters in one transaction
+# Returns False if no match exists with the given ID
+async def delete_match(match_id: str):
+    response = await execute(supabase.rpc('delete_match', {"p_match_id": match_id}))
+    if response.data:
+        print(f"Match {match_id} and its participant records have been deleted.")
+    return bool(response.data)
 
-# Function to get the head-to-head record between two users
-def get_head_to_head_record(user1_id: str, user2_id: str):
-    # Fetch all matches where both users participated on opposing teams
-    response = supabase.table('matches').select('*').execute()
+# Function to get the head-to-head record between two users, optionally for a single game
+async def get_head_to_head_record(user1_id: str, user2_id: str, game_name: str = None):
+    query = supabase.table('head_to_head').select('wins', 'losses').eq('user_id', user1_id).eq('opponent_id', user2_id)
+    if game_name:
+        query = query.eq('game', game_name)
+    response = await execute(query)
 
     if not response.data:
         return None
 
-    wins_losses = {'user1_wins': 0, 'user2_wins': 0}
-
-    for match in response.data:
-        if (user1_id in match['team1'] and user2_id in match['team2']) or (user1_id in match['team2'] and user2_id in match['team1']):
-            # Determine which user was on the winning team
-            if match['winner'] == 'Team A' and user1_id in match['team1']:
-                wins_losses['user1_wins'] += 1
-            elif match['winner'] == 'Team B' and user1_id in match['team2']:
-                wins_losses['user1_wins'] += 1
-            elif match['winner'] == 'Team A' and user2_id in match['team1']:
-                wins_losses['user2_wins'] += 1
-            elif match['winner'] == 'Team B' and user2_id in match['team2']:
-                wins_losses['user2_wins'] += 1
-
-    return wins_losses
+    # Sum the records across games; user1's losses against user2 are user2's wins
+    return {
+        'user1_wins': sum(record['wins'] for record in response.data),
+        'user2_wins': sum(record['losses'] for record in response.data)
+    }
 
-def get_head_to_head_record_against_all(user_id: str):
-    # Fetch all matches where the user participated
-    response = supabase.table('matches').select('*').execute()
+# Function to get a user's head-to-head record against every opponent, optionally for a single game
+async def get_head_to_head_record_against_all(user_id: str, game_name: str = None):
+    query = supabase.table('head_to_head').select('opponent_id', 'wins', 'losses').eq('user_id', user_id)
+    if game_name:
+        query = query.eq('game', game_name)
+    response = await execute(query)
 
     if not response.data:
         return None
 
+    # Combine the per-game records for each opponent
     h2h_records = {}
-
-    for match in response.data:
-        # Determine if the user was on Team A or Team B
-        if user_id in match['team1']:
-            user_team = 'Team A'
-            opponent_team = 'Team B'
-            opponents = match['team2']
-        elif user_id in match['team2']:
-            user_team = 'Team B'
-            opponent_team = 'Team A'
-            opponents = match['team1']
-        else:
-            continue  # User was not part of this match
-
-        # Check the result and update the head-to-head records
-        for opponent_id in opponents:
-            if opponent_id not in h2h_records:
-                h2h_records[opponent_id] = {'wins': 0, 'losses': 0}
-
-            if match['winner'] == user_team:
-                h2h_records[opponent_id]['wins'] += 1
-            else:
-                h2h_records[opponent_id]['losses'] += 1
+    for record in response.data:
+        opponent_record = h2h_records.setdefault(record['opponent_id'], {'wins': 0, 'losses': 0})
+        opponent_record['wins'] += record['wins']
+        opponent_record['losses'] += record['losses']
 
     # Filter out records with no wins or losses
     filtered_records = {k: v for k, v in h2h_records.items() if v['wins'] > 0 or v['losses'] > 0}
@@ -0,0 +1,86 @@
+from functools import lru_cache
+from itertools import combinations
+
+# Function to list the candidate Team A bitmasks for a lobby size, cached since lobby sizes are fixed
+# With even teams, the first player is pinned to Team A so each split is only listed once, not mirrored
+@lru_cache(maxsize=None)
+def split_masks(player_count):
+    team_size = player_count // 2
+    if player_count % 2 == 0 and player_count > 0:
+        return tuple(1 | sum(1 << i for i in rest) for rest in combinations(range(1, player_count), team_size - 1))
+    return tuple(sum(1 << i for i in team) for team in combinations(range(player_count), team_size))
+
+# Function to split players into the two teams whose rating totals are closest
+# players is a list of (member, rating) tuples; every possible split is considered
+# Optional secondary objectives, weighted against the rating difference:
+#   spread_weight  - penalises teams whose rating spreads (highest - lowest) differ
+#   repeat_weight  - penalises each pair of recent teammates placed on the same team again
+#   recent_teammates is a set of frozenset({user_id, user_id}) pairs
+def balance_teams(players, recent_teammates=frozenset(), spread_weight=0.0, repeat_weight=0.0):
+    # Work on the players sorted by rating, highest first, so a team's highest and lowest
+    # ratings are simply those of its lowest and highest set bits
+    players = sorted(players, key=lambda x: x[1], reverse=True)
+    player_count = len(players)
+    ratings = [rating for _, rating in players]
+    total_rating = sum(ratings)
+    all_players = (1 << player_count) - 1
+
+    # Precompute the rating sum of every subset of each half of the bits, so a split's sum is two lookups
+    half = player_count // 2
+    low_sums = [0] * (1 << half)
+    for mask in range(1, 1 << half):
+        low_bit = mask & -mask
+        low_sums[mask] = low_sums[mask ^ low_bit] + ratings[low_bit.bit_length() - 1]
+    high_sums = [0] * (1 << (player_count - half))
+    for mask in range(1, 1 << (player_count - half)):
+        low_bit = mask & -mask
+        high_sums[mask] = high_sums[mask ^ low_bit] + ratings[half + low_bit.bit_length() - 1]
+    low_mask = (1 << half) - 1
+
+    # For each player, a bitmask of the players they were teammates with recently
+    recent_teammate_masks = [0] * player_count
+    repeat_pair_count = 0
+    if repeat_weight and recent_teammates:
+        for i, j in combinations(range(player_count), 2):
+            if frozenset((players[i][0].id, players[j][0].id)) in recent_teammates:
+                recent_teammate_masks[i] |= 1 << j
+                recent_teammate_masks[j] |= 1 << i
+                repeat_pair_count += 1
+
+    # Visit splits from the smallest rating difference up; the secondary penalties are never negative,
+    # so once the rating difference alone is no better than the best split, no later split can win
+    masks = split_masks(player_count)
+    differences = [abs(total_rating - 2 * (low_sums[mask & low_mask] + high_sums[mask >> half])) for mask in masks]
+    best_cost = None
+    best_team_a = 0
+    for index in sorted(range(len(masks)), key=differences.__getitem__):
+        cost = differences[index]
+        if best_cost is not None and cost >= best_cost:
+            break
+        team_a = masks[index]
+
+        if spread_weight:
+            team_b = all_players ^ team_a
+            spread_a = ratings[team_a.bit_length() - 1] - ratings[(team_a & -team_a).bit_length() - 1]
+            spread_b = ratings[team_b.bit_length() - 1] - ratings[(team_b & -team_b).bit_length() - 1] if team_b else 0
+            cost += spread_weight * abs(spread_a - spread_b)
+
+        if repeat_pair_count:
+            # Pairs kept together are all recent pairs minus those split across the teams
+            team_b = all_players ^ team_a
+            split_pairs = 0
+            remaining = team_a
+            while remaining:
+                low_bit = remaining & -remaining
+                split_pairs += (recent_teammate_masks[low_bit.bit_length() - 1] & team_b).bit_count()
+                remaining ^= low_bit
+            cost += repeat_weight * (repeat_pair_count - split_pairs)
+
+        if best_cost is None or cost < best_cost:
+            best_cost = cost
+            best_team_a = team_a
+
+    # Each team keeps the rating order, highest first, for display
+    team_a = [players[i] for i in range(player_count) if best_team_a >> i & 1]
+    team_b = [players[i] for i in range(player_count) if not best_team_a >> i & 1]
+    return team_a, team_b
@@ -1,5 +1,10 @@
+import asyncio
+import time
+import config
 import discord
+from datetime import timedelta
 from discord.ui import Button, View
+from match_session import sessions
 
 from config import CHANNEL_INFO
 
@@ -24,88 +29,93 @@ class QueueView(View):
         from matchmaking import handle_leaderboard
         await handle_leaderboard(interaction, self.channel_id)
 
-class TeamManagementView(View):
-    def __init__(self, team_a, team_b, game_name: str, organizer_id=None):
-        super().__init__()
-        self.team_a = team_a
-        self.team_b = team_b
-        self.game_name = game_name
-        self.organizer_id = organizer_id
-        self.update_buttons()
+# Base view for a match session's components, which only the organizer may use
+# Every component's custom_id is derived from the session ID, so the view can be registered again after a restart
+class MatchSessionView(View):
+    def __init__(self, session):
+        super().__init__(timeout=None)
+        self.session = session
 
     async def interaction_check(self, interaction: discord.Interaction) -> bool:
-        # Allow only the organizer to interact with the buttons
-        if interaction.user.id != self.organizer_id:
+        if self.session.ended:
+            await interaction.response.send_message("This lobby has already finished or expired.", ephemeral=True)
+            return False
+
+        # Allow only the organizer to interact with the components
+        if interaction.user.id != self.session.organizer_id:
             await interaction.response.send_message("You are not the organizer for this game.", ephemeral=True)
             return False
         return True
 
+class TeamManagementView(MatchSessionView):
+    def __init__(self, session, guild):
+        super().__init__(session)
+        self.guild = guild
+        self.update_buttons()
+
     def update_buttons(self):
         # Clear existing buttons
         self.clear_items()
 
         # Add buttons for each player
-        for player, _ in self.team_a:
-            self.add_item(MovePlayerButton(player, "A", "B", self, self.organizer_id))
-        
-        for player, _ in self.team_b:
-            self.add_item(MovePlayerButton(player, "B", "A", self, self.organizer_id))
+        for user_id, _ in self.session.team_a:
+            self.add_item(MovePlayerButton(self, user_id, "A"))
+
+        for user_id, _ in self.session.team_b:
+            self.add_item(MovePlayerButton(self, user_id, "B"))
 
-        # Add the confirm button and pass the game name
-        self.add_item(ConfirmTeamsButton(self, self.game_name, self.organizer_id))
+        # Add the confirm button
+        self.add_item(ConfirmTeamsButton(self))
 
 class MovePlayerButton(Button):
-    def __init__(self, player, from_team, to_team, team_view, organizer_id=None):
-        self.player = player
-        self.from_team = from_team
-        self.to_team = to_team
+    def __init__(self, team_view, user_id, from_team):
+        member = team_view.guild.get_member(user_id) if team_view.guild else None
+        label = f"Move {member.display_name if member else user_id}"
+        super().__init__(label=label, style=discord.ButtonStyle.primary, custom_id=team_view.session.custom_id(f"move:{user_id}"))
         self.team_view = team_view
-        self.organizer_id = organizer_id
-        label = f"Move {player.display_name}"
-        super().__init__(label=label, style=discord.ButtonStyle.primary)
+        self.user_id = user_id
+        self.from_team = from_team
 
     async def callback(self, interaction: discord.Interaction):
-        if not await self.team_view.interaction_check(interaction):
-            return
-        
-        # Find the player's current rank
+        session = self.team_view.session
         if self.from_team == "A":
-            player_tuple = next((p, r) for p, r in self.team_view.team_a if p == self.player)
-            self.team_view.team_a.remove(player_tuple)
-            self.team_view.team_b.append(player_tuple)
+            from_team, to_team = session.team_a, session.team_b
         else:
-            player_tuple = next((p, r) for p, r in self.team_view.team_b if p == self.player)
-            self.team_view.team_b.remove(player_tuple)
-            self.team_view.team_a.append(player_tuple)
-        
+            from_team, to_team = session.team_b, session.team_a
+
+        # Find the player's current rank and move them to the other team
+        player_tuple = next(((user_id, rank) for user_id, rank in from_team if user_id == self.user_id), None)
+        if player_tuple is None:
+            return await interaction.response.send_message("That player has already been moved.", ephemeral=True)
+        from_team.remove(player_tuple)
+        to_team.append(player_tuple)
+
         # Update the buttons in the view
         self.team_view.update_buttons()
-        await interaction.response.edit_message(embed=create_team_embed(self.team_view.team_a, self.team_view.team_b), view=self.team_view)
+        await interaction.response.edit_message(embed=create_team_embed(session.team_a, session.team_b), view=self.team_view)
+        await session.save()
 
 class ConfirmTeamsButton(Button):
-    def __init__(self, team_view, game_name: str, organizer_id=None):
-        super().__init__(label="Confirm Teams", style=discord.ButtonStyle.success)
+    def __init__(self, team_view):
+        super().__init__(label="Confirm Teams", style=discord.ButtonStyle.success, custom_id=team_view.session.custom_id("confirm"))
         self.team_view = team_view
-        self.game_name = game_name
-        self.organizer_id = organizer_id
 
     async def callback(self, interaction: discord.Interaction):
-        if not await self.team_view.interaction_check(interaction):
-            return 
-        
+        session = self.team_view.session
+
         # Defer the interaction to allow more time to process
         await interaction.response.defer()
 
         # Combine all players from both teams
-        all_players = self.team_view.team_a + self.team_view.team_b
+        all_players = session.team_a + session.team_b
 
         # Calculate the overall rank range across both teams
         min_rank = min(rank for _, rank in all_players)
         max_rank = max(rank for _, rank in all_players)
 
         # Calculate the average rank for each team
-        avg_rank_a = sum(rank for _, rank in self.team_view.team_a) / len(self.team_view.team_a)
-        avg_rank_b = sum(rank for _, rank in self.team_view.team_b) / len(self.team_view.team_b)
+        avg_rank_a = sum(rank for _, rank in session.team_a) / len(session.team_a)
+        avg_rank_b = sum(rank for _, rank in session.team_b) / len(session.team_b)
 
         # Create the confirmation embed with the teams, their average ranks, and overall rank range
         embed = discord.Embed(
@@ -115,42 +125,43 @@ class ConfirmTeamsButton(Button):
         )
         embed.add_field(
             name=f"**Team A**\n(Avg Rank: {avg_rank_a:.2f})",
-            value="\n".join([f"{player.mention} (Rank: {rank})" for player, rank in self.team_view.team_a]),
+            value="\n".join([f"<@{user_id}> (Rank: {rank})" for user_id, rank in session.team_a]),
             inline=True
         )
         embed.add_field(
             name=f"**Team B**\n(Avg Rank: {avg_rank_b:.2f})",
-            value="\n".join([f"{player.mention} (Rank: {rank})" for player, rank in self.team_view.team_b]),
+            value="\n".join([f"<@{user_id}> (Rank: {rank})" for user_id, rank in session.team_b]),
             inline=True
         )
         embed.set_footer(text="Select a map to proceed.")
 
-        # Insert match details into Supabase and store the match ID
+        # Create the match and every player link in one atomic call and store the match ID
         from supabase_client import insert_match
-        team1 = [str(player.id) for player, _ in self.team_view.team_a]
-        team2 = [str(player.id) for player, _ in self.team_view.team_b]
-        match_id = insert_match(team1, team2, self.game_name)
+        team1 = [str(user_id) for user_id, _ in session.team_a]
+        team2 = [str(user_id) for user_id, _ in session.team_b]
+        match_id = await insert_match(team1, team2, session.game_name)
+        if match_id is None:
+            return await interaction.followup.send("Could not create the match. Please confirm the teams again.", ephemeral=True)
+
+        # Remember the teams so upcoming suggestions avoid repeating teammates
+        from matchmaking import record_teams
+        record_teams(session.game_name, [user_id for user_id, _ in session.team_a], [user_id for user_id, _ in session.team_b])
 
         # Use followup.send to capture the message ID correctly
         match_message = await interaction.followup.send(embed=embed, ephemeral=False)
-        match_message_id = match_message.id
 
         # Fetch the map pool from Supabase
         from supabase_client import get_map_pool
-        map_pool = get_map_pool(self.game_name)
-
-        # Ensure the correct arguments are passed
-        select_map_view = SelectMapView(
-            maps=map_pool,
-            match_id=match_id,
-            match_message_id=match_message_id,
-            team_a=self.team_view.team_a,
-            team_b=self.team_view.team_b,
-            game_name=self.game_name,
-            organizer_id=self.organizer_id
-        )
-        
-        await match_message.edit(view=select_map_view)
+        session.maps = await get_map_pool(session.game_name)
+        session.map_page = 1
+        session.match_id = match_id
+        session.stage = "map"
+        session.message_id = match_message.id
+        session.track_message(match_message.id)
+        session.untrack_message(interaction.message.id)
+
+        await match_message.edit(view=SelectMapView(session))
+        await session.save()
 
         # Delete the original team management message
         try:
@@ -158,175 +169,162 @@ class ConfirmTeamsButton(Button):
         except discord.errors.NotFound:
             pass
 
-class SelectMapView(View):
-    def __init__(self, maps, match_id, match_message_id, team_a, team_b, game_name, organizer_id, current_page=1, total_pages=None):
-        super().__init__(timeout=None)
-        self.maps = maps
-        self.match_id = match_id
-        self.match_message_id = match_message_id
-        self.team_a = team_a
-        self.team_b = team_b
-        self.game_name = game_name
-        self.organizer_id = organizer_id
-        self.current_page = current_page
-        self.total_pages = total_pages or (len(maps) + 24) // 25
+class SelectMapView(MatchSessionView):
+    def __init__(self, session):
+        super().__init__(session)
+        self.total_pages = (len(session.maps) + 24) // 25
 
         # If maps are available, add the map selection dropdown and pagination buttons
-        if maps:
-            self.add_item(SelectMapDropdown(maps, match_id, match_message_id, team_a, team_b, game_name, organizer_id, current_page, self.total_pages))
+        if session.maps:
+            self.add_item(SelectMapDropdown(self))
 
             # Add pagination buttons if there are multiple pages
             if self.total_pages > 1:
-                self.add_item(PaginationButton("previous", maps, match_id, match_message_id, team_a, team_b, game_name, organizer_id, current_page, self.total_pages))
-                self.add_item(PaginationButton("next", maps, match_id, match_message_id, team_a, team_b, game_name, organizer_id, current_page, self.total_pages))
+                self.add_item(PaginationButton(self, "previous"))
+                self.add_item(PaginationButton(self, "next"))
         else:
             # If no maps are available, show the "Match Complete" button directly
-            self.add_item(TeamVoiceButton(self.team_a, self.team_b, self.game_name, self.organizer_id))
-            self.add_item(MatchCompleteButton(match_id, team_a, team_b, game_name, match_message_id, organizer_id))
+            self.add_item(TeamVoiceButton(session))
+            self.add_item(MatchCompleteButton(session))
 
 class SelectMapDropdown(discord.ui.Select):
-    def __init__(self, maps, match_id, match_message_id, team_a, team_b, game_name, organizer_id, current_page, total_pages):
+    def __init__(self, map_view):
+        session = map_view.session
+        current_page = session.map_page
         super().__init__(
-            placeholder=f"Select a map... (Page {current_page}/{total_pages})",
+            placeholder=f"Select a map... (Page {current_page}/{map_view.total_pages})",
             min_values=1,
             max_values=1,
             options=[
-                discord.SelectOption(label=map_name) for map_name in maps[(current_page-1)*25 : current_page*25]
-            ]
+                discord.SelectOption(label=map_name) for map_name in session.maps[(current_page-1)*25 : current_page*25]
+            ],
+            custom_id=session.custom_id("map")
         )
-        self.match_id = match_id
-        self.match_message_id = match_message_id
-        self.team_a = team_a
-        self.team_b = team_b
-        self.game_name = game_name
-        self.organizer_id = organizer_id
-        self.current_page = current_page
-        self.total_pages = total_pages
+        self.session = session
 
     async def callback(self, interaction: discord.Interaction):
-        if interaction.user.id != self.organizer_id:
-            return await interaction.response.send_message("You are not the organizer for this game.", ephemeral=True)
-
         selected_map = self.values[0]
 
         # Update the selected map in the Supabase
         from supabase_client import update_match_map
-        update_match_map(self.match_id, selected_map)
+        await update_match_map(self.session.match_id, selected_map)
 
         # Fetch the existing embed to update it
         embed = interaction.message.embeds[0]
         embed.description += f"\n**Map:** {selected_map}"
-        
+
         # Acknowledge the interaction and update the message
-        await interaction.response.edit_message(embed=embed, view=MatchCompleteView(self.match_id, self.team_a, self.team_b, self.game_name, self.match_message_id, self.organizer_id))
+        self.session.stage = "playing"
+        await interaction.response.edit_message(embed=embed, view=MatchCompleteView(self.session))
+        await self.session.save()
 
 class PaginationButton(discord.ui.Button):
-    def __init__(self, direction, maps, match_id, match_message_id, team_a, team_b, game_name, organizer_id, current_page, total_pages):
-        super().__init__(label="Previous" if direction == "previous" else "Next", style=discord.ButtonStyle.secondary)
+    def __init__(self, map_view, direction):
+        super().__init__(
+            label="Previous" if direction == "previous" else "Next",
+            style=discord.ButtonStyle.secondary,
+            custom_id=map_view.session.custom_id(f"map_{direction}")
+        )
+        self.session = map_view.session
         self.direction = direction
-        self.maps = maps
-        self.match_id = match_id
-        self.match_message_id = match_message_id
-        self.team_a = team_a
-        self.team_b = team_b
-        self.game_name = game_name
-        self.organizer_id = organizer_id
-        self.current_page = current_page
-        self.total_pages = total_pages
+        self.total_pages = map_view.total_pages
 
     async def callback(self, interaction: discord.Interaction):
-        if interaction.user.id != self.organizer_id:
-            return await interaction.response.send_message("You are not the organizer for this game.", ephemeral=True)
-
+        current_page = self.session.map_page
         if self.direction == "previous":
-            new_page = self.current_page - 1 if self.current_page > 1 else self.total_pages
+            new_page = current_page - 1 if current_page > 1 else self.total_pages
         else:
-            new_page = self.current_page + 1 if self.current_page < self.total_pages else 1
+            new_page = current_page + 1 if current_page < self.total_pages else 1
 
         # Create a new SelectMapView with the updated page
-        new_view = SelectMapView(self.maps, self.match_id, self.match_message_id, self.team_a, self.team_b, self.game_name, self.organizer_id, new_page, self.total_pages)
-        
+        self.session.map_page = new_page
+
         # Acknowledge the interaction and update the message
-        await interaction.response.edit_message(view=new_view)
+        await interaction.response.edit_message(view=SelectMapView(self.session))
+        await self.session.save()
 
-class MatchCompleteView(View):
-    def __init__(self, match_id, team_a, team_b, game_name, match_message_id, organizer_id=None):
-        super().__init__(timeout=None)
-        self.match_id = match_id
-        self.team_a = team_a
-        self.team_b = team_b
-        self.game_name = game_name
-        self.match_message_id = match_message_id
-        self.organizer_id = organizer_id
+class MatchCompleteView(MatchSessionView):
+    def __init__(self, session):
+        super().__init__(session)
 
         # Add the Team Voice button to this view
-        self.add_item(TeamVoiceButton(team_a, team_b, game_name, organizer_id))
+        self.add_item(TeamVoiceButton(session))
 
         # Add the Match Complete button to this view
-        self.add_item(MatchCompleteButton(match_id, team_a, team_b, game_name, match_message_id, organizer_id))
+        self.add_item(MatchCompleteButton(session))
+
+# Function to move members into voice channels concurrently, at most VOICE_MOVE_CONCURRENCY at a time
+# moves is a list of (user_id, voice_channel); returns the user IDs that were moved, skipped, denied or failed
+async def move_members(guild, moves):
+    semaphore = asyncio.Semaphore(config.VOICE_MOVE_CONCURRENCY)
+
+    async def move(user_id, voice_channel):
+        member = guild.get_member(user_id)
+        # Members can only be moved while they are connected to voice
+        if member is None or member.voice is None:
+            return "skipped"
+        if member.voice.channel == voice_channel:
+            return "moved"
+        async with semaphore:
+            try:
+                await member.move_to(voice_channel)
+                return "moved"
+            except discord.errors.Forbidden:
+                return "denied"
+            except discord.HTTPException as e:
+                print(f"Error moving {user_id} to {voice_channel}: {e}")
+                return "failed"
+
+    results = await asyncio.gather(*(move(user_id, voice_channel) for user_id, voice_channel in moves))
+    summary = {"moved": [], "skipped": [], "denied": [], "failed": []}
+    for (user_id, _), result in zip(moves, results):
+        summary[result].append(user_id)
+    return summary
+
+# Function to describe the result of move_members in one message
+def format_move_summary(summary, destination):
+    lines = [f"Moved {len(summary['moved'])} players {destination}."]
+    if summary["skipped"]:
+        lines.append("Not in a voice channel: " + ", ".join(f"<@{user_id}>" for user_id in summary["skipped"]))
+    if summary["denied"]:
+        lines.append("Insufficient permissions to move: " + ", ".join(f"<@{user_id}>" for user_id in summary["denied"]))
+    if summary["failed"]:
+        lines.append("Could not move: " + ", ".join(f"<@{user_id}>" for user_id in summary["failed"]))
+    return "\n".join(lines)
 
 class TeamVoiceButton(Button):
-    def __init__(self, team_a, team_b, game_name, organizer_id=None):
-        super().__init__(label="Team Voice", style=discord.ButtonStyle.primary)
-        self.team_a = team_a
-        self.team_b = team_b
-        self.game_name = game_name
-        self.organizer_id = organizer_id
+    def __init__(self, session):
+        super().__init__(label="Team Voice", style=discord.ButtonStyle.primary, custom_id=session.custom_id("team_voice"))
+        self.session = session
 
     async def callback(self, interaction: discord.Interaction):
-        if interaction.user.id != self.organizer_id:
-            return await interaction.response.send_message("You are not the organizer for this game.", ephemeral=True)
-
         # Find the channel info for the game
-        channel_info = next((info for info in CHANNEL_INFO if info["title"].lower().startswith(self.game_name.lower())), None)
+        channel_info = next((info for info in CHANNEL_INFO if info["title"].lower().startswith(self.session.game_name.lower())), None)
 
         if not channel_info:
             return await interaction.response.send_message("Channel information not found for this game.", ephemeral=True)
 
-        # Fetch the voice channel IDs for Team A and Team B
-        team_a_channel_id = channel_info["team_a_channel_id"]
-        team_b_channel_id = channel_info["team_b_channel_id"]
+        # Fetch the voice channels for Team A and Team B
+        team_a_channel = interaction.guild.get_channel(channel_info["team_a_channel_id"])
+        team_b_channel = interaction.guild.get_channel(channel_info["team_b_channel_id"])
 
-        # Move Team A members to their voice channel
-        team_a_channel = interaction.guild.get_channel(team_a_channel_id)
+        moves = []
         if team_a_channel is not None:
-            for member, _ in self.team_a:
-                if member.voice:  # Check if the member is in a voice channel
-                    try:
-                        await member.move_to(team_a_channel)
-                    except discord.errors.Forbidden:
-                        await interaction.response.send_message(f"Could not move {member.mention} to the voice channel. Insufficient permissions.", ephemeral=True)
-                else:
-                    await interaction.response.send_message(f"{member.mention} is not in a voice channel.", ephemeral=True)
-
-        # Move Team B members to their voice channel
-        team_b_channel = interaction.guild.get_channel(team_b_channel_id)
+            moves += [(user_id, team_a_channel) for user_id, _ in self.session.team_a]
         if team_b_channel is not None:
-            for member, _ in self.team_b:
-                if member.voice:  # Check if the member is in a voice channel
-                    try:
-                        await member.move_to(team_b_channel)
-                    except discord.errors.Forbidden:
-                        await interaction.response.send_message(f"Could not move {member.mention} to the voice channel. Insufficient permissions.", ephemeral=True)
-                else:
-                    await interaction.response.send_message(f"{member.mention} is not in a voice channel.", ephemeral=True)
+            moves += [(user_id, team_b_channel) for user_id, _ in self.session.team_b]
 
-        await interaction.response.send_message("Teams have been moved to their respective voice channels.", ephemeral=True)
+        # Move both teams at once and report the outcome in a single response
+        await interaction.response.defer(ephemeral=True)
+        summary = await move_members(interaction.guild, moves)
+        await interaction.followup.send(format_move_summary(summary, "to their team voice channels"), ephemeral=True)
 
 class MatchCompleteButton(Button):
-    def __init__(self, match_id, team_a, team_b, game_name, match_message_id, organizer_id=None):
-        super().__init__(label="Match Complete", style=discord.ButtonStyle.green)
-        self.match_id = match_id
-        self.team_a = team_a
-        self.team_b = team_b
-        self.game_name = game_name
-        self.match_message_id = match_message_id
-        self.organizer_id = organizer_id
+    def __init__(self, session):
+        super().__init__(label="Match Complete", style=discord.ButtonStyle.green, custom_id=session.custom_id("complete"))
+        self.session = session
 
     async def callback(self, interaction: discord.Interaction):
-        if interaction.user.id != self.organizer_id:
-            return await interaction.response.send_message("You are not the organizer for this game.", ephemeral=True)
-
         # Create the embed to ask which team won
         embed = discord.Embed(
             title="Select the Winning Team",
@@ -336,164 +334,164 @@ class MatchCompleteButton(Button):
         # Provide buttons to select the winning team
         await interaction.response.send_message(
             embed=embed,
-            view=SelectWinnerView(self.team_a, self.team_b, self.match_message_id, self.game_name, self.match_id, self.organizer_id),
+            view=SelectWinnerView(self.session),
             ephemeral=False
         )
 
-class SelectWinnerView(View):
-    def __init__(self, team_a, team_b, match_message_id, game_name, match_id, organizer_id=None):
-        super().__init__(timeout=None)
-        self.match_id = match_id
-        self.team_a = team_a
-        self.team_b = team_b
-        self.match_message_id = match_message_id
-        self.organizer_id = organizer_id
-        self.add_item(SelectWinnerButton("Team A", self.team_a, self.team_a, self.team_b, match_message_id, game_name, self.match_id, self.organizer_id))
-        self.add_item(SelectWinnerButton("Team B", self.team_b, self.team_a, self.team_b, match_message_id, game_name, self.match_id, self.organizer_id))
+        # Remember the prompt so its buttons can be restored after a restart
+        winner_message = await interaction.original_response()
+        self.session.winner_message_id = winner_message.id
+        self.session.track_message(winner_message.id)
+        await self.session.save()
+
+class SelectWinnerView(MatchSessionView):
+    def __init__(self, session):
+        super().__init__(session)
+        self.add_item(SelectWinnerButton(session, "Team A"))
+        self.add_item(SelectWinnerButton(session, "Team B"))
 
 class SelectWinnerButton(Button):
-    def __init__(self, team_name, team, team_a, team_b, match_message_id, game_name, match_id, organizer_id=None):
-        super().__init__(label=f"{team_name} Wins", style=discord.ButtonStyle.success)
+    def __init__(self, session, team_name):
+        super().__init__(
+            label=f"{team_name} Wins",
+            style=discord.ButtonStyle.success,
+            custom_id=session.custom_id(f"winner:{team_name[-1].lower()}")
+        )
+        self.session = session
         self.team_name = team_name
-        self.team = team
-        self.team_a = team_a
-        self.team_b = team_b
-        self.match_message_id = match_message_id
-        self.game_name = game_name
-        self.match_id = match_id
-        self.organizer_id = organizer_id
 
     async def callback(self, interaction: discord.Interaction):
-        if interaction.user.id != self.organizer_id:
-            return await interaction.response.send_message("You are not the organizer for this game.", ephemeral=True)
+        session = self.session
 
-        try:
-            # Attempt to delete the "Select Winning Team" embed
-            await interaction.message.delete()
-        except discord.errors.NotFound:
-            pass
+        # Settle the match before touching any messages; the settlement is idempotent per match
+        from supabase_client import update_match, get_match_details
 
+        winning_team, losing_team = (session.team_a, session.team_b) if self.team_name == "Team A" else (session.team_b, session.team_a)
+        winners = [str(user_id) for user_id, _ in winning_team]
+        losers = [str(user_id) for user_id, _ in losing_team]
+        # Defer so a slow settlement cannot expire the interaction
+        await interaction.response.defer(ephemeral=True)
         try:
-            # Attempt to delete the original "Match Confirmed" embed using the stored Discord message ID
-            if self.match_message_id:
-                match_message = await interaction.channel.fetch_message(self.match_message_id)
-                if match_message:
-                    await match_message.delete()
-        except discord.errors.NotFound:
-            pass
-        
+            settled = await update_match(session.match_id, self.team_name, session.game_name, winners, losers)
+            winner = self.team_name
+            if not settled:
+                # Already settled, e.g. a lost response or a restart before the result was posted;
+                # announce the winner that was actually recorded
+                match_details = await get_match_details(session.match_id)
+                if match_details and match_details["winner"]:
+                    winner = match_details["winner"]
+        except Exception as e:
+            print(f"Error settling match {session.match_id}: {e}")
+            return await interaction.followup.send("Could not record the result for this match. Please try again.", ephemeral=True)
+
+        # Only stop once the result has been posted; claim it before the next await so it is posted once
+        if session.stage == "result":
+            return await interaction.followup.send("The result for this match has already been recorded.", ephemeral=True)
+        previous_stage = session.stage
+        session.stage = "result"
+
         # Announce the winner and print out the teams in an embed
-        team_a_names = "\n".join([player.mention for player, _ in self.team_a])
-        team_b_names = "\n".join([player.mention for player, _ in self.team_b])
+        team_a_names = "\n".join([f"<@{user_id}>" for user_id, _ in session.team_a])
+        team_b_names = "\n".join([f"<@{user_id}>" for user_id, _ in session.team_b])
 
         embed = discord.Embed(
-            title=f"**{self.team_name} Wins!**",
+            title=f"**{winner} Wins!**",
             color=discord.Color.gold()
         )
         embed.add_field(name="**Team A**", value=team_a_names, inline=True)
         embed.add_field(name="**Team B**", value=team_b_names, inline=True)
-        
-        # Send the winner announcement embed with a "Requeue" button
-        await interaction.channel.send(embed=embed, view=RequeueView(self.team_a, self.team_b, self.game_name, self.organizer_id))
-
-        # Update the match in the database as complete
-        from supabase_client import update_match, update_rank
-
-        update_match(self.match_id, self.team_name)
-
-        for player, _ in self.team:
-            update_rank(player.id, self.game_name, "win")
-
-        losing_team = self.team_b if self.team_name == "Team A" else self.team_a
-        for player, _ in losing_team:
-            update_rank(player.id, self.game_name, "lose")
-
-class RequeueView(View):
-    def __init__(self, team_a, team_b, game_name, organizer_id=None):
-        super().__init__(timeout=None)
-        self.team_a = team_a
-        self.team_b = team_b
-        self.game_name = game_name
-        self.organizer_id = organizer_id
 
-        self.add_item(RequeueButton(self.team_a, self.team_b, self.game_name, self.organizer_id))
-        self.add_item(LobbyVoiceButton(self.team_a, self.team_b, self.game_name, self.organizer_id))
-        self.add_item(FinishButton(self.organizer_id))
+        try:
+            # Send the winner announcement embed with a "Requeue" button
+            result_message = await interaction.channel.send(embed=embed, view=RequeueView(session))
+        except discord.HTTPException as e:
+            # The result is recorded and the winner buttons are still up, so another click can post it again
+            print(f"Error posting the result for match {session.match_id}: {e}")
+            session.stage = previous_stage
+            return await interaction.followup.send("The result was recorded but could not be posted. Please try again.", ephemeral=True)
+
+        # Delete the "Select Winning Team" prompts and the original "Match Confirmed" embed
+        stale_message_ids = [interaction.message.id, session.message_id]
+        if session.winner_message_id:
+            stale_message_ids.append(session.winner_message_id)
+        stale_message_ids = [message_id for message_id in dict.fromkeys(stale_message_ids) if message_id]
+        session.message_id = result_message.id
+        session.track_message(result_message.id)
+        session.winner_message_id = None
+        try:
+            await delete_messages_by_id(interaction.channel, stale_message_ids)
+            for message_id in stale_message_ids:
+                session.untrack_message(message_id)
+        except discord.HTTPException as e:
+            # Leave them tracked so Requeue or Finish removes them with the rest of the lobby
+            print(f"Error deleting the winner prompts for match {session.match_id}: {e}")
+        await session.save()
+
+class RequeueView(MatchSessionView):
+    def __init__(self, session):
+        super().__init__(session)
+        self.add_item(RequeueButton(session))
+        self.add_item(LobbyVoiceButton(session))
+        self.add_item(FinishButton(session))
+
+# Function to rebuild the views a session currently has on screen, as (view, message_id) pairs
+def build_session_views(session, guild):
+    if session.stage == "teams":
+        views = [(TeamManagementView(session, guild), session.message_id)]
+    elif session.stage == "map":
+        views = [(SelectMapView(session), session.message_id)]
+    elif session.stage == "playing":
+        views = [(MatchCompleteView(session), session.message_id)]
+    else:
+        views = [(RequeueView(session), session.message_id)]
+
+    # The winner prompt is open alongside the match message until a result is recorded
+    if session.winner_message_id:
+        views.append((SelectWinnerView(session), session.winner_message_id))
+    return [(view, message_id) for view, message_id in views if message_id]
 
 # ui_components.py
 class RequeueButton(Button):
-    def __init__(self, team_a, team_b, game_name, organizer_id=None):
-        super().__init__(label="Requeue", style=discord.ButtonStyle.green)
-        self.team_a = team_a
-        self.team_b = team_b
-        self.game_name = game_name
-        self.organizer_id = organizer_id
+    def __init__(self, session):
+        super().__init__(label="Requeue", style=discord.ButtonStyle.green, custom_id=session.custom_id("requeue"))
+        self.session = session
 
     async def callback(self, interaction: discord.Interaction):
-        if interaction.user.id != self.organizer_id:
-            return await interaction.response.send_message("You are not the organizer for this game.", ephemeral=True)
+        session = self.session
 
-        # Combine players from both teams
-        players = self.team_a + self.team_b
+        # Claim the session before the first await so a double click cannot requeue the lobby twice
+        if sessions.pop(session.session_id, None) is None:
+            return await interaction.response.send_message("This lobby has already finished.", ephemeral=True)
+
+        # Combine players from both teams, skipping anyone who has left the server
+        players = [interaction.guild.get_member(user_id) for user_id, _ in session.team_a + session.team_b]
+        players = [player for player in players if player]
 
         await interaction.response.defer(ephemeral=True)
 
-        # Get the channel ID for the game
-        channel_info = next(
-            (info for info in CHANNEL_INFO if info["title"].lower().startswith(self.game_name.lower())),
-            None,
-        )
-        if not channel_info:
-            return await interaction.response.send_message(
-                "Channel information not found for this game.", ephemeral=True
-            )
-        channel_id = channel_info["channel_id"]
+        # The session was started from the queue in this channel
+        channel_id = session.channel_id
         queue_channel = interaction.guild.get_channel(channel_id)
-        channel = interaction.channel
 
-        # Retrieve the original queue message ID from the channel's context
-        from matchmaking import queues
-        queue_info = queues.get(channel.id)
-        if not queue_info or not queue_info.get("message_id"):
-            await interaction.response.send_message("Could not find the original queue message.", ephemeral=True)
-            return
+        # Delete every message posted for this match, including the requeue message
+        await delete_messages_by_id(interaction.channel, session.message_ids)
 
-        original_queue_message_id = queue_info["message_id"]
-
-        # Delete all messages in the channel except the original queue message
-        async for message in channel.history(limit=100):
-            if message.id != original_queue_message_id and message.author == channel.guild.me:
-                try:
-                    await message.delete()
-                except discord.errors.NotFound:
-                    pass 
-
-        from matchmaking import add_user_to_queue
-        # Loop over each player and add them to the queue
-        for player, _ in players:
-            await add_user_to_queue(player, channel_id, queue_channel)
-        
-        # Send confirmation and delete the requeue message
+        # Add every player to the queue in one step
+        from matchmaking import add_users_to_queue
+        await add_users_to_queue(players, channel_id, queue_channel)
+
+        # Send confirmation
         await interaction.followup.send("Players have been requeued.", ephemeral=True)
-        try:
-            await interaction.message.delete()
-        except discord.errors.NotFound:
-            pass
+        await session.end()
 
 class LobbyVoiceButton(Button):
-    def __init__(self, team_a, team_b, game_name, organizer_id=None):
-        super().__init__(label="Move to Lobby", style=discord.ButtonStyle.primary)
-        self.team_a = team_a
-        self.team_b = team_b
-        self.game_name = game_name
-        self.organizer_id = organizer_id
+    def __init__(self, session):
+        super().__init__(label="Move to Lobby", style=discord.ButtonStyle.primary, custom_id=session.custom_id("lobby_voice"))
+        self.session = session
 
     async def callback(self, interaction: discord.Interaction):
-        if interaction.user.id != self.organizer_id:
-            return await interaction.response.send_message("You are not the organizer for this game.", ephemeral=True)
-
         # Find the channel info for the game
-        channel_info = next((info for info in CHANNEL_INFO if info["title"].lower().startswith(self.game_name.lower())), None)
+        channel_info = next((info for info in CHANNEL_INFO if info["title"].lower().startswith(self.session.game_name.lower())), None)
 
         if not channel_info:
             return await interaction.response.send_message("Channel information not found for this game.", ephemeral=True)
@@ -503,57 +501,55 @@ class LobbyVoiceButton(Button):
 
         # Move all members to the lobby voice channel
         lobby_channel = interaction.guild.get_channel(lobby_channel_id)
-        if lobby_channel is not None:
-            for member, _ in self.team_a + self.team_b:
-                if member.voice:  # Check if the member is in a voice channel
-                    try:
-                        await member.move_to(lobby_channel)
-                    except discord.errors.Forbidden:
-                        await interaction.response.send_message(f"Could not move {member.mention} to the lobby voice channel. Insufficient permissions.", ephemeral=True)
-                else:
-                    await interaction.response.send_message(f"{member.mention} is not in a voice channel.", ephemeral=True)
-
-        await interaction.response.send_message("Teams have been moved back to the lobby voice channel.", ephemeral=True)
+        if lobby_channel is None:
+            return await interaction.response.send_message("The lobby voice channel could not be found.", ephemeral=True)
+
+        await interaction.response.defer(ephemeral=True)
+        summary = await move_members(interaction.guild, [(user_id, lobby_channel) for user_id, _ in self.session.team_a + self.session.team_b])
+        await interaction.followup.send(format_move_summary(summary, "back to the lobby voice channel"), ephemeral=True)
 
 class FinishButton(Button):
-    def __init__(self, organizer_id=None):
-        super().__init__(label="Finish", style=discord.ButtonStyle.danger)
-        self.organizer_id = organizer_id
+    def __init__(self, session):
+        super().__init__(label="Finish", style=discord.ButtonStyle.danger, custom_id=session.custom_id("finish"))
+        self.session = session
 
     async def callback(self, interaction: discord.Interaction):
-        if interaction.user.id != self.organizer_id:
-            return await interaction.response.send_message("You are not the organizer for this game.", ephemeral=True)
+        # Claim the session before the first await so it is only finished once
+        if sessions.pop(self.session.session_id, None) is None:
+            return await interaction.response.send_message("This lobby has already finished.", ephemeral=True)
 
-        # Get the channel and the queue message ID to exclude from deletion
-        channel = interaction.channel
+        await interaction.response.defer(ephemeral=True)
 
-        # Retrieve the original queue message ID from the channel's context
-        from matchmaking import queues
-        queue_info = queues.get(channel.id)
-        if not queue_info or not queue_info.get("message_id"):
-            await interaction.response.send_message("Could not find the original queue message.", ephemeral=True)
-            return
+        # Delete every message posted for this match, including the Requeue and Finish buttons
+        await delete_messages_by_id(interaction.channel, self.session.message_ids)
 
-        original_queue_message_id = queue_info["message_id"]
+        await interaction.followup.send("Match process finished.", ephemeral=True)
+        await self.session.end()
 
-        # Delete all messages in the channel except the original queue message
-        async for message in channel.history(limit=100):
-            if message.id != original_queue_message_id and message.author == channel.guild.me:
-                try:
-                    await message.delete()
-                except discord.errors.NotFound:
-                    pass 
+# Function to delete messages by ID, in bulk where possible
+# Bulk deletion takes up to 100 messages younger than 14 days, so older messages are deleted one at a time
+async def delete_messages_by_id(channel, message_ids):
+    cutoff = discord.utils.utcnow() - timedelta(days=14) + timedelta(minutes=1)
+    recent = [discord.Object(id=message_id) for message_id in message_ids if discord.utils.snowflake_time(message_id) > cutoff]
+    older = [message_id for message_id in message_ids if discord.utils.snowflake_time(message_id) <= cutoff]
 
-        # Remove the Requeue and Finish buttons by editing the view
+    for start in range(0, len(recent), 100):
+        chunk = recent[start:start + 100]
         try:
-            await interaction.message.delete()
-        except discord.errors.NotFound:
-            pass 
+            await channel.delete_messages(chunk)
+        except discord.HTTPException as e:
+            # e.g. a message was already deleted by hand; retry the chunk one message at a time
+            print(f"Bulk delete failed in channel {channel.id}, deleting individually: {e}")
+            older.extend(message.id for message in chunk)
 
-        await interaction.response.send_message("Match process finished.", ephemeral=True)
+    for message_id in older:
+        try:
+            await channel.get_partial_message(message_id).delete()
+        except discord.errors.NotFound:
+            pass
 
 class Paginator(View):
-    def __init__(self, bot, title, data, page_size, page, total_pages, update_func, **kwargs):
+    def __init__(self, bot, title, data, page_size, page, total_pages, update_func, fetch_page=None, **kwargs):
         super().__init__(timeout=None)
         self.bot = bot
         self.title = title
@@ -562,6 +558,8 @@ class Paginator(View):
         self.page = page
         self.total_pages = total_pages
         self.update_func = update_func
+        # Optional coroutine (page, page_size) -> rows used to load pages on demand instead of slicing data
+        self.fetch_page = fetch_page
         self.kwargs = kwargs
 
         # Add buttons to the view
@@ -578,9 +576,12 @@ class Paginator(View):
         self.add_item(self.close_button)
 
     async def update_embed(self, interaction):
-        start_index = (self.page - 1) * self.page_size
-        end_index = start_index + self.page_size
-        embed_data = self.data[start_index:end_index]
+        if self.fetch_page:
+            embed_data = await self.fetch_page(self.page, self.page_size)
+        else:
+            start_index = (self.page - 1) * self.page_size
+            end_index = start_index + self.page_size
+            embed_data = self.data[start_index:end_index]
 
         embed = discord.Embed(
             title=self.title,
@@ -616,9 +617,51 @@ class Paginator(View):
         except discord.errors.NotFound:
             pass
 
+# Function to create the team management embed; team_a and team_b are lists of (user_id, rating)
 def create_team_embed(team_a, team_b):
     embed = discord.Embed(title="Team Management", color=discord.Color.blue())
-    embed.add_field(name="**Team A**", value="\n".join([f"{player.mention} (Rank: {rank})" for player, rank in team_a]), inline=True)
-    embed.add_field(name="**Team B**", value="\n".join([f"{player.mention} (Rank: {rank})" for player, rank in team_b]), inline=True)
+    embed.add_field(name="**Team A**", value="\n".join([f"<@{user_id}> (Rank: {rank})" for user_id, rank in team_a]), inline=True)
+    embed.add_field(name="**Team B**", value="\n".join([f"<@{user_id}> (Rank: {rank})" for user_id, rank in team_b]), inline=True)
     embed.set_footer(text="Use the buttons below to edit teams or confirm when ready.")
     return embed
+
+# Posts a placeholder message and progressively edits it as a streamed response arrives
+# Edits are throttled to one per STREAM_EDIT_INTERVAL seconds to stay within Discord's edit rate limits
+class StreamedMessage:
+    def __init__(self, channel, placeholder="..."):
+        self.channel = channel
+        self.placeholder = placeholder
+        self.message = None
+        self.shown_text = None
+        self.last_edit = 0.0
+
+    async def update(self, text):
+        if self.message is None:
+            self.message = await self.channel.send(text[:2000] or self.placeholder)
+            self.shown_text = text
+            self.last_edit = time.monotonic()
+        elif text and time.monotonic() - self.last_edit >= config.STREAM_EDIT_INTERVAL:
+            await self.edit(text)
+
+    async def edit(self, text):
+        self.last_edit = time.monotonic()
+        if text == self.shown_text:
+            return
+        try:
+            await self.message.edit(content=text[:2000])
+            self.shown_text = text
+        except discord.HTTPException as e:
+            print(f"Error editing streamed message: {e}")
+
+    # Function to show the final text, or remove the placeholder if there is nothing to show
+    async def finish(self, text):
+        if self.message is None:
+            if text:
+                await self.channel.send(text[:2000])
+        elif text:
+            await self.edit(text)
+        else:
+            try:
+                await self.message.delete()
+            except discord.errors.NotFound:
+                pass